@@ -0,0 +1,256 @@
+"""
+Offline benchmark for the disease prediction service.
+
+Runs every (model, format) configuration in a fresh subprocess so cold start
+and memory are measured honestly, drives the real prediction blueprint through
+the Flask test client and through an in-process threaded WSGI server, and
+prints one JSON document that can be stored and diffed between commits.
+
+    cd backend
+    python -m benchmarks.predict_bench --models ExtraTrees XGBoost --out bench.json
+
+No MongoDB, network or credentials are needed: only the prediction blueprint
+is mounted on a bare Flask app.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DATASET = BACKEND_DIR.parent / 'models' / 'dataset.csv'
+
+
+def symptom_sets(n, seed=0, dataset=DATASET):
+    """Realistic symptom lists: random 2..k subsets of real dataset.csv rows."""
+    with open(dataset, newline='', encoding='utf-8') as fp:
+        reader = csv.reader(fp)
+        next(reader)
+        rows = [[s.strip() for s in row[1:] if s.strip()] for row in reader]
+    rows = [r for r in rows if len(r) >= 2]
+    rng = random.Random(seed)
+    sets = []
+    for _ in range(n):
+        row = rng.choice(rows)
+        sets.append(rng.sample(row, rng.randint(2, len(row))))
+    return sets
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))], 3)
+
+    return {
+        'count': len(ordered),
+        'mean': round(statistics.fmean(ordered), 3),
+        'p50': pct(50),
+        'p95': pct(95),
+        'p99': pct(99),
+        'max': round(ordered[-1], 3),
+    }
+
+
+def memory_usage():
+    """RSS and (where the kernel reports it) PSS in MB; PSS shows mmap sharing between workers."""
+    usage = {}
+    for path, keys in (('/proc/self/status', ('VmRSS',)), ('/proc/self/smaps_rollup', ('Pss',))):
+        try:
+            with open(path) as fp:
+                for line in fp:
+                    name = line.split(':')[0]
+                    if name in keys:
+                        usage[name.lower() + '_mb'] = round(int(line.split()[1]) / 1024.0, 2)
+        except OSError:
+            continue
+    if 'vmrss_mb' not in usage:
+        import resource
+        usage['maxrss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 2)
+    return usage
+
+
+def bench_app():
+    from flask import Flask
+    from blueprints.prediction import prediction_bp
+
+    app = Flask(__name__)
+    app.register_blueprint(prediction_bp)
+    return app
+
+
+def run_test_client(app, sets, requests):
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    for i in range(requests):
+        started = time.perf_counter()
+        response = client.post('/predict', json=sets[i % len(sets)])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        errors += response.status_code >= 500
+    return dict(percentiles(latencies), server_errors=errors)
+
+
+def run_batches(app, sets, batch_sizes, rounds):
+    client = app.test_client()
+    results = {}
+    for size in batch_sizes:
+        elapsed = 0.0
+        for r in range(rounds):
+            batch = [sets[(r * size + i) % len(sets)] for i in range(size)]
+            started = time.perf_counter()
+            client.post('/predict/batch', json={'symptoms': batch})
+            elapsed += time.perf_counter() - started
+        results[str(size)] = {
+            'rows_per_sec': round(size * rounds / elapsed, 1),
+            'ms_per_batch': round(elapsed * 1000.0 / rounds, 3),
+        }
+    return results
+
+
+def run_wsgi_server(app, sets, requests, concurrency):
+    """Real HTTP over a threaded in-process WSGI server, to exercise the micro-batcher."""
+    import http.client
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_port
+    local = threading.local()
+
+    def one(i):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        body = json.dumps(sets[i % len(sets)])
+        started = time.perf_counter()
+        conn.request('POST', '/predict', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return (time.perf_counter() - started) * 1000.0
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+    finally:
+        server.shutdown()
+    return dict(percentiles(latencies), concurrency=concurrency, requests_per_sec=round(requests / wall, 1))
+
+
+def worker(args):
+    """Runs inside the subprocess for one configuration and prints its JSON result."""
+    started = time.perf_counter()
+    from utils.modelRegistry import model_registry
+    import_ms = (time.perf_counter() - started) * 1000.0
+
+    result = {'model': model_registry.model_name, 'format': model_registry.model_format}
+    load_started = time.perf_counter()
+    try:
+        bundle = model_registry.get()
+    except Exception as e:
+        result['error'] = str(e)
+        print(json.dumps(result))
+        return 0
+    result['cold_start_ms'] = {
+        'import': round(import_ms, 3),
+        'load_and_warm': round((time.perf_counter() - load_started) * 1000.0, 3),
+    }
+    result['loaded'] = {'class': type(bundle.model).__name__, 'path': str(bundle.path)}
+    result['memory_after_load'] = memory_usage()
+
+    app = bench_app()
+    sets = symptom_sets(max(args.requests, 512), seed=args.seed)
+    run_test_client(app, sets, min(50, args.requests))  # warm the request path
+
+    result['single_request'] = run_test_client(app, sets, args.requests)
+    result['batch'] = run_batches(app, sets, args.batch_sizes, args.batch_rounds)
+    result['wsgi'] = run_wsgi_server(app, sets, args.requests, args.concurrency)
+
+    from utils.prediction import inference_batcher
+    result['scheduler'] = inference_batcher.metrics() if inference_batcher else None
+    result['memory_after_run'] = memory_usage()
+    print(json.dumps(result))
+    return 0
+
+
+def run_config(model, fmt, args):
+    env = dict(os.environ,
+               PREDICTION_MODEL=model,
+               PREDICTION_MODEL_FORMAT=fmt,
+               MODEL_RELOAD_INTERVAL='0',
+               # Every request must reach the model, not the result cache
+               PREDICTION_CACHE_SIZE='0')
+    command = [sys.executable, '-m', 'benchmarks.predict_bench', '--worker',
+               '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+               '--batch-rounds', str(args.batch_rounds), '--seed', str(args.seed),
+               '--batch-sizes', *map(str, args.batch_sizes)]
+    proc = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        return {'model': model, 'format': fmt, 'error': (proc.stderr or proc.stdout).strip()[-2000:]}
+    return json.loads(lines[-1])
+
+
+def environment():
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+    for module in ('numpy', 'sklearn', 'xgboost', 'flask'):
+        try:
+            info[module] = __import__(module).__version__
+        except Exception:
+            info[module] = None
+    try:
+        info['git_commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                            text=True).stdout.strip() or None
+    except OSError:
+        info['git_commit'] = None
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the disease prediction service offline')
+    parser.add_argument('--models', nargs='+', default=['ExtraTrees', 'XGBoost'])
+    parser.add_argument('--formats', nargs='+', default=['pickle', 'artifact'],
+                        help='model formats to compare (pickle, flat, artifact); missing ones are reported as errors')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--batch-rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results JSON here instead of stdout')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return worker(args)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': environment(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('out', 'worker')},
+        'runs': [run_config(model, fmt, args) for model in args.models for fmt in args.formats],
+    }
+    output = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(output)
+        print(f'Wrote {args.out}')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import os
+
+from flask import Blueprint, request, jsonify
+
+from utils import eventLog
+from utils.modelRegistry import model_registry, ModelUnavailable
+
+prediction_bp = Blueprint('prediction', __name__)
+
+PREDICT_BATCH_MAX = int(os.getenv('PREDICT_BATCH_MAX', 256))
+
+log = eventLog.get_logger('prediction')
+
+def _prediction_unavailable(e):
+    return jsonify({
+        'error': str(e),
+        'message': 'The prediction service is currently unavailable. Please contact support.',
+        'searched_paths': e.searched_paths
+    }), 503
+
+@prediction_bp.route('/predict', methods=['POST'])
+def predict():
+    try:
+        from utils.inferenceBatcher import SchedulerBusy
+        from utils.prediction import PredictionError, symptom_columns, cached_response
+
+        try:
+            bundle = model_registry.get()
+        except ModelUnavailable as e:
+            return _prediction_unavailable(e)
+
+        data = request.get_json(force=True)
+
+        try:
+            columns, _ = symptom_columns(bundle.symptom_index, data)
+            return jsonify(cached_response(bundle, columns))
+        except PredictionError as e:
+            return jsonify({'error': str(e)}), e.status
+        except SchedulerBusy as e:
+            return jsonify({'error': str(e)}), 503
+        except Exception as e:
+            eventLog.event(log, 'model_error', level=eventLog.ERROR, exc_info=True)
+            return jsonify({'error': str(e), 'message': 'Prediction failed.'}), 500
+        
+    except ImportError as e:
+        return jsonify({
+            'error': f'Required libraries not available: {str(e)}',
+            'message': 'Disease prediction requires additional libraries. Please install numpy and scikit-learn.'
+        }), 503
+    except Exception as e:
+        eventLog.event(log, 'prediction_failed', level=eventLog.ERROR, exc_info=True)
+        return jsonify({
+            'error': str(e),
+            'message': 'An error occurred while predicting disease. Please try again later.'
+        }), 500
+
+@prediction_bp.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Score many symptom lists in one call.
+    Body: {"symptoms": [["itching", "skin_rash"], ["cough", "high_fever"], ...]}
+    Returns one entry per input, in input order: either {"predictions": [...]} or {"error": "..."}.
+    """
+    try:
+        from utils.prediction import PredictionError, symptom_columns, encode_rows, build_response, prediction_cache
+
+        data = request.get_json(force=True)
+        symptom_lists = data.get('symptoms') if isinstance(data, dict) else data
+        if not isinstance(symptom_lists, list) or not symptom_lists:
+            return jsonify({'error': 'A non-empty list of symptom lists is required'}), 400
+        if len(symptom_lists) > PREDICT_BATCH_MAX:
+            return jsonify({'error': f'At most {PREDICT_BATCH_MAX} symptom lists can be scored per request'}), 413
+
+        try:
+            bundle = model_registry.get()
+        except ModelUnavailable as e:
+            return _prediction_unavailable(e)
+
+        results = [None] * len(symptom_lists)
+        rows = []
+        positions = []
+        for position, symptoms in enumerate(symptom_lists):
+            try:
+                columns, _ = symptom_columns(bundle.symptom_index, symptoms if isinstance(symptoms, list) else [])
+            except PredictionError as e:
+                results[position] = {'error': str(e)}
+                continue
+            cached = prediction_cache.get(bundle, columns)
+            if cached is not None:
+                results[position] = {'error': str(cached)} if isinstance(cached, PredictionError) else {'predictions': cached}
+                continue
+            rows.append(columns)
+            positions.append(position)
+
+        if rows:
+            # One vectorized predict_proba call for the whole batch
+            try:
+                proba = bundle.model.predict_proba(encode_rows(len(bundle.symptoms), rows))
+            except Exception as e:
+                eventLog.event(log, 'model_error', level=eventLog.ERROR, exc_info=True)
+                return jsonify({'error': str(e), 'message': 'Prediction failed.'}), 500
+
+            for position, columns, proba_row in zip(positions, rows, proba):
+                try:
+                    predictions = build_response(bundle, proba_row)
+                    results[position] = {'predictions': predictions}
+                except PredictionError as e:
+                    predictions = e
+                    results[position] = {'error': str(e)}
+                prediction_cache.set(bundle, columns, predictions)
+
+        return jsonify({'results': results}), 200
+
+    except ImportError as e:
+        return jsonify({
+            'error': f'Required libraries not available: {str(e)}',
+            'message': 'Disease prediction requires additional libraries. Please install numpy and scikit-learn.'
+        }), 503
+    except Exception as e:
+        eventLog.event(log, 'batch_prediction_failed', level=eventLog.ERROR, exc_info=True)
+        return jsonify({
+            'error': str(e),
+            'message': 'An error occurred while predicting disease. Please try again later.'
+        }), 500
+
+@prediction_bp.route('/predict/health', methods=['GET'])
+def predict_health():
+    health = model_registry.health()
+    try:
+        from utils.prediction import inference_batcher, prediction_cache
+        health['scheduler'] = inference_batcher.metrics() if inference_batcher else None
+        health['cache'] = prediction_cache.stats()
+    except ImportError:
+        health['scheduler'] = None
+        health['cache'] = None
+    return jsonify(health), 200 if health['status'] == 'ready' else 503
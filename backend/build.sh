@@ -13,6 +13,8 @@ if [ -d "../models" ]; then
     echo "✅ Models directory found"
     if [ -f "../models/ExtraTrees" ]; then
         echo "✅ ML model file found"
+        # Single-file mmap artifact: faster worker start, one physical copy shared by all workers
+        python -m utils.modelArtifact build ../models/ExtraTrees || echo "⚠️  Warning: model artifact build failed, the pickled model will be used."
     else
         echo "⚠️  Warning: ML model file not found. Disease prediction may not work."
     fi
@@ -20,5 +22,21 @@ else
     echo "⚠️  Warning: Models directory not found. Disease prediction may not work."
 fi
 
+# Mongo indexes (utils/indexes.py): idempotent, then check no query shape falls back to a collection scan
+if [ -n "$DBURL" ]; then
+    # One-off: fees saved as strings before they were parsed to numbers
+    python -m utils.doctorDirectory migrate-fees || echo "⚠️  Warning: fee migration failed, fee filters may miss older doctors."
+    # Embedded wallet_history arrays into the ledger (idempotent, safe to re-run)
+    python -m utils.walletLedger migrate-history || echo "⚠️  Warning: wallet history migration failed, unmigrated history is still served from the user documents."
+    # Embedded upcomingAppointments/completedMeets into meet_appointments (idempotent, safe to re-run)
+    python -m utils.appointments migrate || echo "⚠️  Warning: appointment migration failed, unmigrated users are migrated on first use."
+    # Exits 1 when a unique index is blocked by duplicate values; the deploy goes on without it
+    # (see utils/indexes.py) until the duplicates listed above are merged
+    python -m utils.indexes apply || echo "⚠️  Warning: some indexes could not be created (duplicates listed above), deploying without them."
+    python -m utils.indexes explain || echo "⚠️  Warning: some queries are not backed by an index, see above."
+else
+    echo "⚠️  Warning: DBURL not set, skipping index bootstrap."
+fi
+
 echo "✅ Build complete!"
 
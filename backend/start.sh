@@ -14,10 +14,16 @@ fi
 
 # Start Gunicorn with appropriate workers
 # For free tier, use 1-2 workers to conserve resources
+# Threaded workers let concurrent /predict calls share one micro-batch
+# Exported so the app can size itself: presence warns when several workers run
+# without PRESENCE_REDIS_URL and caps SSE clients per worker to leave threads for the API
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
+export GUNICORN_THREADS=${GUNICORN_THREADS:-4}
 exec gunicorn app:app \
     --bind 0.0.0.0:$PORT \
-    --workers 2 \
-    --worker-class sync \
+    --workers $WEB_CONCURRENCY \
+    --worker-class gthread \
+    --threads $GUNICORN_THREADS \
     --timeout 120 \
     --access-logfile - \
     --error-logfile - \
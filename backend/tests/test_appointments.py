@@ -0,0 +1,61 @@
+from utils import appointments as appointmentStore
+
+PATIENT = {
+    '_id': 1,
+    'email': 'p@example.com',
+    'upcomingAppointments': [{'link': 'meet-1', 'date': '2026-01-02', 'time': '10:00', 'doctor': 'D'}],
+    'completedMeets': [{'link': 'meet-0', 'date': '2025-12-01', 'time': '09:00', 'doctor': 'D', 'stars': 5}],
+}
+
+
+class FakeUsers:
+    def __init__(self, doc):
+        self.doc = dict(doc)
+        self.reads = 0
+
+    def find_one(self, query, projection):
+        self.reads += 1
+        if query['email'] != self.doc['email'] or self.doc.get(appointmentStore.MIGRATED):
+            return None
+        return self.doc
+
+    def update_one(self, query, update):
+        self.doc.update(update['$set'])
+
+
+class FakeAppointments:
+    def __init__(self):
+        self.ops = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+
+
+def setup_function():
+    appointmentStore._migrated.clear()
+
+
+def test_migrate_user_copies_embedded_appointments_once():
+    users, appointments = FakeUsers(PATIENT), FakeAppointments()
+
+    appointmentStore.migrate_user(appointments, users, 'pemail', 'p@example.com')
+    assert sorted(op._filter['link'] for op in appointments.ops) == ['meet-0', 'meet-1']
+    assert all(op._doc['$set']['pemail'] == 'p@example.com' for op in appointments.ops)
+    assert users.doc[appointmentStore.MIGRATED] is True
+
+    # Cached in this worker: no further reads
+    appointmentStore.migrate_user(appointments, users, 'pemail', 'p@example.com')
+    assert users.reads == 1
+
+    # Another worker sees the flag and copies nothing
+    appointmentStore._migrated.clear()
+    appointmentStore.migrate_user(appointments, users, 'pemail', 'p@example.com')
+    assert len(appointments.ops) == 2
+
+
+def test_completed_meets_keep_their_status():
+    appointments = FakeAppointments()
+    appointmentStore.migrate_user(appointments, FakeUsers(PATIENT), 'pemail', 'p@example.com')
+    updates = {op._filter['link']: op._doc for op in appointments.ops}
+    assert updates['meet-0']['$set']['status'] == appointmentStore.COMPLETED
+    assert updates['meet-1']['$setOnInsert']['status'] == appointmentStore.UPCOMING
@@ -0,0 +1,153 @@
+import time
+
+from utils.notifications import EMAIL, NotificationService, PermanentError, PersistentQueue, build_email
+
+
+class FakeSender:
+    """send_batch returns the next scripted result per payload (None = delivered)."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.batches = []
+
+    def send_batch(self, payloads):
+        self.batches.append(payloads)
+        return [self.results.pop(0) if self.results else None for _ in payloads]
+
+
+def _service(tmp_path, sender, **kwargs):
+    queue = PersistentQueue(str(tmp_path / 'queue.db'))
+    return NotificationService(queue, {EMAIL: sender}, workers=1, **kwargs)
+
+
+def _rows(queue):
+    with queue._connect() as db:
+        return db.execute('SELECT id, status, attempts, available_at, last_error FROM jobs ORDER BY id').fetchall()
+
+
+def test_claim_leases_jobs_until_the_lease_expires(tmp_path):
+    queue = PersistentQueue(str(tmp_path / 'queue.db'), lease=60)
+    queue.put(EMAIL, {'n': 1})
+    queue.put(EMAIL, {'n': 2})
+
+    claimed = queue.claim(EMAIL, 10)
+    assert [payload for _, payload, _ in claimed] == [{'n': 1}, {'n': 2}]
+    assert queue.claim(EMAIL, 10) == []
+
+    # A worker that claimed them died: once the lease runs out they are claimable again
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET available_at = 0")
+    assert len(queue.claim(EMAIL, 10)) == 2
+
+
+def test_delivered_jobs_are_acked(tmp_path):
+    sender = FakeSender()
+    service = _service(tmp_path, sender)
+    service.queue.put(EMAIL, {'n': 1})
+
+    assert service.process(EMAIL) == 1
+    assert sender.batches == [[{'n': 1}]]
+    assert _rows(service.queue) == []
+
+
+def test_failed_jobs_are_retried_with_backoff(tmp_path):
+    service = _service(tmp_path, FakeSender(RuntimeError('smtp down')), backoff=10.0, max_backoff=100.0)
+    service.queue.put(EMAIL, {'n': 1})
+
+    before = time.time()
+    service.process(EMAIL)
+    [(_, status, attempts, available_at, error)] = _rows(service.queue)
+    assert (status, attempts, error) == ('pending', 1, 'smtp down')
+    # First retry waits backoff * 2**0 with up to 50% jitter
+    assert before + 5.0 <= available_at <= time.time() + 10.0
+    assert service.queue.claim(EMAIL, 10) == []
+
+
+def test_backoff_grows_and_is_capped(tmp_path):
+    service = _service(tmp_path, FakeSender(), backoff=2.0, max_backoff=20.0)
+    for attempts, ceiling in ((0, 2.0), (1, 4.0), (3, 16.0), (10, 20.0)):
+        delay = service._delay(attempts)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_jobs_are_buried_after_max_attempts_or_a_permanent_error(tmp_path):
+    service = _service(tmp_path, FakeSender(RuntimeError('temporary'), PermanentError('not configured')),
+                       max_attempts=2)
+    service.queue.put(EMAIL, {'n': 1})
+    service.queue.put(EMAIL, {'n': 2})
+    with service.queue._connect() as db:
+        db.execute("UPDATE jobs SET attempts = 1 WHERE id = 1")
+
+    service.process(EMAIL)
+    assert [(status, attempts, error) for _, status, attempts, _, error in _rows(service.queue)] == [
+        ('dead', 2, 'temporary'), ('dead', 1, 'not configured')]
+    assert service.stats()['channels'][EMAIL]['dead'] == 2
+    assert service.queue.claim(EMAIL, 10) == []
+
+
+def test_released_attachment_files_are_deleted_once_the_job_is_done(tmp_path):
+    service = _service(tmp_path, FakeSender(None, RuntimeError('temporary')), max_attempts=1)
+    sent, dead, kept = tmp_path / 'sent.pdf', tmp_path / 'dead.pdf', tmp_path / 'kept.pdf'
+    for path in (sent, dead, kept):
+        path.write_bytes(b'%PDF')
+    attachment = {'filename': 'Receipt.pdf', 'content_type': 'application/pdf'}
+    service.queue.put(EMAIL, {'attachments': [dict(attachment, path=str(sent), release=True)]})
+    service.queue.put(EMAIL, {'attachments': [dict(attachment, path=str(dead), release=True),
+                                              dict(attachment, path=str(kept))]})
+
+    service.process(EMAIL)
+    assert not sent.exists() and not dead.exists()
+    assert kept.exists()
+
+
+def test_build_email_reads_path_attachments(tmp_path):
+    path = tmp_path / 'rx.pdf'
+    path.write_bytes(b'%PDF-1.4 test')
+    message = build_email({'subject': 'Receipt', 'recipients': ['p@example.com'], 'html': '<p>Hi</p>',
+                           'attachments': [{'filename': 'Receipt.pdf', 'content_type': 'application/pdf',
+                                            'path': str(path)}]}, 'noreply@example.com')
+    [attachment] = message.iter_attachments()
+    assert attachment.get_content() == b'%PDF-1.4 test'
+
+
+def test_worker_survives_queue_errors(tmp_path):
+    sender = FakeSender()
+    service = _service(tmp_path, sender, backoff=0.01, poll_interval=0.01)
+    service.queue.put(EMAIL, {'n': 1})
+    claim = service.queue.claim
+    calls = []
+
+    def flaky_claim(channel, limit):
+        calls.append(channel)
+        if len(calls) == 1:
+            raise OSError('database is locked')
+        return claim(channel, limit)
+
+    service.queue.claim = flaky_claim
+    service.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not sender.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        service.stop()
+    assert len(calls) > 1
+    assert sender.batches == [[{'n': 1}]]
+
+
+def test_start_delivers_a_backlog_without_a_new_enqueue(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    PersistentQueue(path).put(EMAIL, {'n': 1})  # left behind by a previous process
+    sender = FakeSender()
+    service = NotificationService(PersistentQueue(path), {EMAIL: sender}, workers=1, poll_interval=0.01)
+
+    service.start()
+    service.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not sender.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        service.stop()
+    assert sender.batches == [[{'n': 1}]]
+    assert len(service._threads) == 1
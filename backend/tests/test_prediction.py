@@ -0,0 +1,50 @@
+import ast
+import os
+
+import pytest
+
+from utils.prediction import PredictionError, build_symptom_index, symptom_columns
+
+SYMPTOMS = ['itching', 'skin_rash', 'cough', 'high_fever']
+MODEL_APP = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'app.py')
+
+
+def _model_service_parse_symptoms(symptom_index):
+    """models/app.py's parse_symptoms, loaded without importing the service (it loads the model at import)."""
+    with open(MODEL_APP, encoding='utf-8') as fp:
+        tree = ast.parse(fp.read())
+    [function] = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'parse_symptoms']
+    namespace = {'symptom_index': symptom_index}
+    exec(compile(ast.Module(body=[function], type_ignores=[]), MODEL_APP, 'exec'), namespace)
+    return namespace['parse_symptoms']
+
+
+def _backend(data):
+    try:
+        return symptom_columns(build_symptom_index(SYMPTOMS), data)[0]
+    except PredictionError as e:
+        return str(e)
+
+
+def _model_service(data):
+    try:
+        return _model_service_parse_symptoms(build_symptom_index(SYMPTOMS))(data)[0]
+    except ValueError as e:
+        return str(e)
+
+
+@pytest.mark.parametrize('data', [
+    ['itching', 'itching'],
+    ['itching', 'itching', 'cough'],
+    ['cough', 'itching', 'cough'],
+    ['itching', 'unknown'],
+    ['itching'],
+    [],
+])
+def test_both_services_validate_symptoms_alike(data):
+    assert _backend(data) == _model_service(data)
+
+
+def test_repeated_symptoms_count_once():
+    assert _backend(['itching', 'itching']) == 'Not enough recognized symptoms. Please provide more symptoms.'
+    assert _backend(['cough', 'itching', 'cough']) == [0, 2]
@@ -0,0 +1,64 @@
+import io
+
+from werkzeug.datastructures import FileStorage
+
+from utils import prescriptions
+
+
+def _upload(tmp_path, content=b'%PDF-1.4 test'):
+    storage = FileStorage(io.BytesIO(content), 'rx.pdf', content_type='application/pdf')
+    return prescriptions.receive(storage, spool_dir=str(tmp_path / 'spool'))
+
+
+def _queue(tmp_path, monkeypatch, deliver, failed):
+    monkeypatch.setenv('PRESCRIPTION_QUEUE_PATH', str(tmp_path / 'prescriptions.db'))
+    monkeypatch.setenv('PRESCRIPTION_MAX_ATTEMPTS', '2')
+    service = prescriptions.create_queue(deliver, lambda job, error: failed.append((job['name'], str(error))))
+    service.backoff = 0
+    return service
+
+
+def test_upload_is_spooled_to_one_file(tmp_path):
+    upload = _upload(tmp_path)
+    job = prescriptions.job(upload, pemail='p@example.com')
+
+    assert 'data' not in job
+    assert prescriptions.read(job) == b'%PDF-1.4 test'
+    assert [path.name for path in (tmp_path / 'spool').iterdir()] == [upload.name]
+
+    upload.discard()
+    assert list((tmp_path / 'spool').iterdir()) == []
+
+
+def test_job_survives_until_delivered(tmp_path, monkeypatch):
+    delivered, failed = [], []
+    job = prescriptions.job(_upload(tmp_path), pemail='p@example.com')
+
+    first = _queue(tmp_path, monkeypatch, delivered.append, failed)
+    first.queue.put(prescriptions.PRESCRIPTION, job)
+
+    # A new process over the same queue file picks the job up
+    second = _queue(tmp_path, monkeypatch, delivered.append, failed)
+    assert second.drain(timeout=5)
+    assert [prescriptions.read(payload) for payload in delivered] == [b'%PDF-1.4 test']
+    assert delivered[0]['pemail'] == 'p@example.com'
+    assert failed == []
+
+
+def test_job_is_marked_failed_after_the_last_attempt(tmp_path, monkeypatch):
+    attempts, failed = [], []
+
+    def deliver(job):
+        attempts.append(job['name'])
+        raise OSError('cloudinary unavailable')
+
+    service = _queue(tmp_path, monkeypatch, deliver, failed)
+    upload = _upload(tmp_path)
+    service.queue.put(prescriptions.PRESCRIPTION, prescriptions.job(upload))
+
+    assert service.drain(timeout=5)
+    assert attempts == [upload.name, upload.name]
+    assert failed == [(upload.name, 'cloudinary unavailable')]
+    assert service.queue.counts() == {prescriptions.PRESCRIPTION: {'dead': 1}}
+    # Given up on: the spool file goes with it
+    assert list((tmp_path / 'spool').iterdir()) == []
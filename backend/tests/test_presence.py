@@ -0,0 +1,62 @@
+import json
+
+from utils.presence import InMemoryPresenceStore, PresenceRegistry, RedisPresenceStore
+
+DOCTORS = [{'email': 'a@example.com', 'status': 'offline'}, {'email': 'b@example.com', 'status': 'offline'},
+           {'email': 'c@example.com', 'status': 'offline'}]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hgetall(self, key):
+        self.commands.append(key)
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [self.redis.hashes.get(key, {}) for key in self.commands]
+
+
+class FakeRedis:
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hgetall(self, key):
+        self.round_trips += 1
+        return self.hashes.get(key, {})
+
+
+def _redis_store(states):
+    store = RedisPresenceStore.__new__(RedisPresenceStore)
+    # Stored the way update() writes them: JSON values, bytes on the way back
+    store._redis = FakeRedis({RedisPresenceStore.PREFIX + email: {k.encode(): json.dumps(v).encode()
+                                                                  for k, v in state.items()}
+                              for email, state in states.items()})
+    return store
+
+
+def test_overlay_all_reads_redis_once():
+    store = _redis_store({'a@example.com': {'status': 'online'}, 'c@example.com': {'status': 'online', 'meet': True}})
+    registry = PresenceRegistry(collection=None, store=store)
+
+    overlaid = registry.overlay_all(iter(DOCTORS))
+
+    assert store._redis.round_trips == 1
+    assert overlaid == [{'email': 'a@example.com', 'status': 'online'}, DOCTORS[1],
+                        {'email': 'c@example.com', 'status': 'online', 'meet': True}]
+    assert overlaid == [registry.overlay(doc) for doc in DOCTORS]
+
+
+def test_overlay_all_with_the_memory_store():
+    store = InMemoryPresenceStore(ttl=60)
+    store.update('b@example.com', {'status': 'online'})
+    registry = PresenceRegistry(collection=None, store=store)
+
+    assert [doc['status'] for doc in registry.overlay_all(DOCTORS)] == ['offline', 'online', 'offline']
+    assert DOCTORS[1]['status'] == 'offline'
@@ -0,0 +1,70 @@
+from utils.userDirectory import DOCTOR, PATIENT, UserDirectory
+
+USER = {
+    'email': 'a@example.com',
+    'username': 'A',
+    'passwd': 'hash',
+    'wallet': 10,
+    'wallet_history': [{'amount': 10}] * 50,
+    'profile_picture': 'https://example.com/a.jpg',
+    'cart': [{'id': 'x', 'quantity': 1}],
+}
+
+
+def _project(doc, projection):
+    included = [field for field, value in projection.items() if value == 1]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if projection.get(field, 1) != 0}
+
+
+class FakeCollection:
+    def __init__(self, name, docs=()):
+        self.name = name
+        self.docs = list(docs)
+        self.projections = []
+
+    def find_one(self, query, projection):
+        self.projections.append(projection)
+        for doc in self.docs:
+            if doc['email'] == query['email']:
+                return _project(doc, projection)
+        return None
+
+    def aggregate(self, pipeline):
+        # Only what UserDirectory sends: $match/$limit/$project per branch, then $unionWith
+        project = pipeline[2]['$project']
+        self.projections.append({k: v for k, v in project.items() if k != '_role'})
+        email = pipeline[0]['$match']['email']
+        for doc in self.docs:
+            if doc['email'] == email:
+                return iter([dict(_project(doc, project), _role=PATIENT)])
+        return iter([])
+
+
+def test_role_projects_one_field_on_union_and_cached_paths():
+    patients = FakeCollection('patients', [USER])
+    directory = UserDirectory(patients, FakeCollection('doctors'))
+
+    assert directory.role('a@example.com') == PATIENT   # $unionWith path
+    assert directory.role('a@example.com') == PATIENT   # cached-role path
+
+    assert patients.projections == [{'email': 1, '_id': 0}, {'email': 1, '_id': 0}]
+
+
+def test_resolve_returns_only_requested_fields():
+    directory = UserDirectory(FakeCollection('patients'), FakeCollection('doctors', [USER]))
+    directory.roles.set('a@example.com', DOCTOR)
+
+    role, doc = directory.resolve('a@example.com', ('wallet',))
+
+    assert role == DOCTOR
+    assert doc == {'wallet': 10}
+    for field in ('wallet_history', 'profile_picture', 'passwd', 'cart'):
+        assert field not in doc
+
+
+def test_unknown_email():
+    directory = UserDirectory(FakeCollection('patients'), FakeCollection('doctors'))
+    assert directory.resolve('nobody@example.com') == (None, None)
+    assert directory.role('') is None
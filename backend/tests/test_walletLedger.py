@@ -0,0 +1,71 @@
+import pytest
+from bson import ObjectId
+
+from utils import walletLedger
+
+HISTORY = [{'amount': 10, 'desc': 'top up'}, {'amount': -4, 'desc': 'order'}, {'amount': 10, 'desc': 'top up'}]
+
+
+class FakeUsers:
+    name = 'patients'
+
+    def __init__(self, docs):
+        self.docs = [dict(doc) for doc in docs]
+        self.fail_updates = 0
+
+    def find(self, query, projection, batch_size=None):
+        return [dict(doc, wallet_history=list(doc['wallet_history'])) for doc in self.docs if doc['wallet_history']]
+
+    def update_one(self, query, update):
+        if self.fail_updates:
+            self.fail_updates -= 1
+            raise ConnectionError('connection reset')
+        count = walletLedger.MIGRATED_COUNT
+        for doc in self.docs:
+            if doc['_id'] == query['_id'] and doc.get(count) == query[count]:
+                pulled = update['$pull']['wallet_history']['$in']
+                doc['wallet_history'] = [entry for entry in doc['wallet_history'] if entry not in pulled]
+                doc[count] = doc.get(count, 0) + update['$inc'][count]
+
+
+class FakeLedger:
+    def __init__(self):
+        self.docs = {}
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            query, update = op._filter, op._doc
+            existing = self.docs.get(query['_id'])
+            if existing is None:
+                self.docs[query['_id']] = dict(query, **update['$setOnInsert'])
+            elif existing['email'] != query['email']:
+                raise AssertionError('duplicate key')
+
+
+def _history(ledger, email):
+    return [doc['history'] for _, doc in sorted(ledger.docs.items()) if doc['email'] == email]
+
+
+def test_rerun_after_a_crash_does_not_duplicate_entries():
+    users, ledger = FakeUsers([{'_id': 1, 'email': 'a@example.com', 'wallet_history': HISTORY}]), FakeLedger()
+
+    users.fail_updates = 1  # copied, then the process dies before the $pull
+    with pytest.raises(ConnectionError):
+        walletLedger.migrate_history(users, ledger, log=lambda *_: None)
+    walletLedger.migrate_history(users, ledger, log=lambda *_: None)
+
+    assert _history(ledger, 'a@example.com') == HISTORY
+    assert users.docs[0]['wallet_history'] == []
+    assert walletLedger.migrate_history(users, ledger, log=lambda *_: None) == 0
+
+
+def test_later_entries_follow_earlier_ones_and_precede_regular_entries():
+    users, ledger = FakeUsers([{'_id': 1, 'email': 'a@example.com', 'wallet_history': HISTORY[:1]},
+                               {'_id': 2, 'email': 'b@example.com', 'wallet_history': HISTORY}]), FakeLedger()
+    walletLedger.migrate_history(users, ledger, log=lambda *_: None)
+    users.docs[0]['wallet_history'] = HISTORY[1:]
+    walletLedger.migrate_history(users, ledger, log=lambda *_: None)
+
+    assert _history(ledger, 'a@example.com') == HISTORY
+    assert _history(ledger, 'b@example.com') == HISTORY
+    assert max(ledger.docs) < ObjectId.from_datetime(walletLedger._now().replace(year=2000))
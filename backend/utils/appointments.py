@@ -0,0 +1,238 @@
+"""
+Appointments stored one document per meet link instead of as
+upcomingAppointments/completedMeets arrays embedded in user documents.
+
+Document: {link, demail, pemail, date, time, doctor, patient, status,
+           stars, prescription, prescription_status, created_at, completed_at}
+status is "upcoming" until the patient rates the meet, then "completed";
+prescription_status is "processing" while an uploaded prescription is stored,
+then "ready", or "failed" (with prescription_error) once its upload is given up on.
+
+Move existing embedded appointments over (safe to run while the app is live
+and to re-run; --prune drops the embedded arrays once they are copied;
+build.sh runs it on every deploy):
+    cd backend
+    python -m utils.appointments migrate --batch-size 500
+
+Users the migration has not reached yet are migrated on first use instead:
+the routes call migrate_user() before reading or completing their
+appointments, so nothing booked before the switch disappears meanwhile.
+Migrated users are marked `appointments_migrated`.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import ReturnDocument, UpdateOne
+
+from utils.ttlCache import TTLCache
+
+COLLECTION = 'meet_appointments'
+UPCOMING = 'upcoming'
+COMPLETED = 'completed'
+
+# Fields returned to the frontend, in the shape the embedded arrays used to have
+APPOINTMENT_PROJECTION = {
+    '_id': 0,
+    'link': 1,
+    'demail': 1,
+    'pemail': 1,
+    'date': 1,
+    'time': 1,
+    'doctor': 1,
+    'patient': 1,
+    'stars': 1,
+    'prescription': 1,
+    'prescription_status': 1,
+}
+_DETAIL_FIELDS = ('demail', 'pemail', 'date', 'time', 'doctor', 'patient', 'prescription', 'stars')
+MIGRATED = 'appointments_migrated'
+
+# Emails this worker already knows to be migrated: one flag lookup per user, not per request
+_migrated = TTLCache(maxsize=int(os.getenv('APPOINTMENTS_MIGRATED_CACHE_SIZE', 10000)), ttl=3600)
+
+APPOINTMENT_INDEXES = [
+    pymongo.IndexModel([('link', 1)], name='appointment_link', unique=True),
+    pymongo.IndexModel([('demail', 1), ('date', 1)], name='appointment_doctor_date'),
+    pymongo.IndexModel([('pemail', 1), ('date', 1)], name='appointment_patient_date'),
+]
+
+
+def ensure_indexes(appointments):
+    appointments.create_indexes(APPOINTMENT_INDEXES)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def upsert(appointments, link, **fields):
+    """
+    Record (or complete the details of) an upcoming appointment.
+
+    The doctor side and the patient side of a booking arrive in separate
+    requests; both land on the same document because it is keyed by link.
+    """
+    details = {k: v for k, v in fields.items() if k in _DETAIL_FIELDS and v is not None}
+    appointments.update_one(
+        {'link': link},
+        {'$set': details, '$setOnInsert': {'status': UPCOMING, 'created_at': _now()}},
+        upsert=True,
+    )
+
+
+def upcoming_for(appointments, role_field, email):
+    """Upcoming appointments of a doctor (role_field="demail") or patient ("pemail")."""
+    cursor = appointments.find({role_field: email, 'status': UPCOMING}, APPOINTMENT_PROJECTION)
+    return list(cursor.sort([('date', 1), ('time', 1)]))
+
+
+def complete(appointments, link, pemail, demail, stars):
+    """
+    Atomically move an upcoming appointment to completed.
+
+    :return: the completed appointment, or None when there is no such upcoming
+             appointment (unknown link, or it was already completed)
+    """
+    return appointments.find_one_and_update(
+        {'link': link, 'pemail': pemail, 'demail': demail, 'status': UPCOMING},
+        {'$set': {'status': COMPLETED, 'stars': stars, 'completed_at': _now()}},
+        projection=APPOINTMENT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def prescription_processing(appointments, link, pemail, demail, name):
+    """Record that a prescription was received and is being uploaded."""
+    result = appointments.update_one(
+        {'link': link, 'pemail': pemail, 'demail': demail},
+        {'$set': {'prescription_status': 'processing', 'prescription_file': name}},
+    )
+    return result.matched_count > 0
+
+
+def attach_prescription(appointments, link, pemail, demail, url):
+    result = appointments.update_one(
+        {'link': link, 'pemail': pemail, 'demail': demail},
+        {'$set': {'prescription': url, 'prescription_status': 'ready'}, '$unset': {'prescription_error': ''}},
+    )
+    return result.matched_count > 0
+
+
+def prescription_failed(appointments, link, pemail, demail, error):
+    """Record that the prescription could not be stored; the doctor has to upload it again."""
+    result = appointments.update_one(
+        {'link': link, 'pemail': pemail, 'demail': demail, 'prescription_status': {'$ne': 'ready'}},
+        {'$set': {'prescription_status': 'failed', 'prescription_error': error}},
+    )
+    return result.matched_count > 0
+
+
+def completed_query(role_field, email, dates):
+    query = {role_field: email, 'status': COMPLETED}
+    date_range = {}
+    if 'date_from' in dates:
+        date_range['$gte'] = dates['date_from']
+    if 'date_to' in dates:
+        date_range['$lte'] = dates['date_to']
+    if date_range:
+        query['date'] = date_range
+    return query
+
+
+# ---- migration from embedded arrays ----
+
+def _migration_ops(owner_field, owner_email, doc):
+    for key, status in (('upcomingAppointments', UPCOMING), ('completedMeets', COMPLETED)):
+        for item in doc.get(key) or []:
+            link = item.get('link')
+            if not link:
+                continue
+            details = {k: item[k] for k in _DETAIL_FIELDS if item.get(k) not in (None, '')}
+            details[owner_field] = owner_email
+            update = {'$set': details, '$setOnInsert': {'created_at': _now()}}
+            if status == COMPLETED:
+                # Completed wins over the other side's stale upcoming copy
+                details['status'] = COMPLETED
+            else:
+                update['$setOnInsert']['status'] = UPCOMING
+            yield UpdateOne({'link': link}, update, upsert=True)
+
+
+def migrate_user(appointments, users, owner_field, email):
+    """
+    Copy one user's embedded appointments into the collection unless that was
+    already done; owner_field is "demail" for doctors, "pemail" for patients.
+    """
+    if not email or _migrated.get(email):
+        return
+    doc = users.find_one({'email': email, MIGRATED: {'$ne': True}},
+                         {'upcomingAppointments': 1, 'completedMeets': 1})
+    if doc is not None:
+        ops = list(_migration_ops(owner_field, email, doc))
+        if ops:
+            appointments.bulk_write(ops, ordered=False)
+        users.update_one({'_id': doc['_id']}, {'$set': {MIGRATED: True}})
+    _migrated.set(email, True)
+
+
+def migrate(appointments, doctors, patients, batch_size=500, prune=False, log=print):
+    """
+    Copy embedded appointments into the appointments collection in unordered
+    bulk batches. Upserts keyed by link make it idempotent, so it can run
+    online and be resumed after a failure.
+    """
+    ensure_indexes(appointments)
+    totals = {'users': 0, 'appointments': 0, 'upserted': 0}
+    has_embedded = {MIGRATED: {'$ne': True},
+                    '$or': [{'upcomingAppointments.0': {'$exists': True}},
+                            {'completedMeets.0': {'$exists': True}}]}
+    for owner_field, users in (('demail', doctors), ('pemail', patients)):
+        ops, emails = [], []
+        cursor = users.find(has_embedded, {'email': 1, 'upcomingAppointments': 1, 'completedMeets': 1},
+                            batch_size=batch_size)
+        for doc in cursor:
+            totals['users'] += 1
+            emails.append(doc['email'])
+            ops.extend(_migration_ops(owner_field, doc['email'], doc))
+            if len(ops) >= batch_size:
+                _flush(appointments, users, ops, emails, prune, totals)
+                log(f"{owner_field}: {totals['appointments']} appointments copied")
+                ops, emails = [], []
+        _flush(appointments, users, ops, emails, prune, totals)
+    log(f"Done: {totals['appointments']} appointments from {totals['users']} users "
+        f"({totals['upserted']} new documents)")
+    return totals
+
+
+def _flush(appointments, users, ops, emails, prune, totals):
+    if ops:
+        result = appointments.bulk_write(ops, ordered=False)
+        totals['appointments'] += len(ops)
+        totals['upserted'] += result.upserted_count
+    if emails:
+        users.update_many({'email': {'$in': emails}}, {'$set': {MIGRATED: True}})
+    if prune and emails:
+        # Only after the batch is safely written
+        users.update_many({'email': {'$in': emails}}, {'$unset': {'upcomingAppointments': '', 'completedMeets': ''}})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the appointments collection')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('migrate', help='copy embedded upcomingAppointments/completedMeets into the collection')
+    run.add_argument('--batch-size', type=int, default=500)
+    run.add_argument('--prune', action='store_true', help='remove the embedded arrays after copying them')
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv('DBURL')).get_database('telmedsphere')
+    migrate(db[COLLECTION], db.doctors, db.patients, batch_size=args.batch_size, prune=args.prune)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
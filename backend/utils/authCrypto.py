@@ -0,0 +1,123 @@
+"""
+Password hashing and Firebase token verification off the request threads.
+
+bcrypt is deliberately slow (tens to hundreds of ms of CPU per hash). The
+bcrypt package releases the GIL while hashing, so a small thread pool
+(AUTH_CRYPTO_WORKERS, default 2) runs hashes in parallel with the request
+threads without forking a gunicorn worker that already has threads running,
+and caps how many cores a burst of logins can take from the API. The work
+factor is BCRYPT_LOG_ROUNDS; hashes made with a different cost are replaced
+transparently at the next successful login.
+
+Decoded Firebase ID tokens are cached until their `exp`, so a client retrying
+or logging in again with the same token skips signature verification
+(firebase_admin already caches Google's public keys per their Cache-Control).
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from utils import eventLog
+from utils.ttlCache import TTLCache
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = 2
+_COST = re.compile(r'^\$2[abxy]?\$(\d\d)\$')
+
+log = eventLog.get_logger('auth')
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds, prefix=b'2b')).decode('utf-8')
+
+
+def _check(hashed, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash (e.g. a Google-only account without a password)
+        return False
+
+
+def cost(hashed):
+    match = _COST.match(hashed or '')
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher:
+    """
+    :param rounds: bcrypt log rounds for new hashes
+    :param workers: pool size; 0 hashes inline on the calling thread
+    """
+
+    def __init__(self, rounds=None, workers=None, timeout=30.0):
+        self.rounds = rounds or int(os.getenv('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS))
+        self.workers = int(os.getenv('AUTH_CRYPTO_WORKERS', DEFAULT_WORKERS)) if workers is None else workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='auth-crypto')
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        return self._pool().submit(fn, *args).result(timeout=self.timeout)
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        if not hashed or not isinstance(password, str):
+            return False
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return cost(hashed) != self.rounds
+
+    def verify(self, hashed, password):
+        """
+        :return: (matches, new_hash) where new_hash is set when the stored hash
+                 uses another work factor and should be replaced
+        """
+        if not self.check(hashed, password):
+            return False, None
+        return True, (self.hash(password) if self.needs_rehash(hashed) else None)
+
+
+class TokenVerifier:
+    """
+    Caches decoded Firebase ID tokens (keyed by their SHA-256) until they expire.
+
+    :param verify: the real verifier, e.g. firebase_admin.auth.verify_id_token
+    """
+
+    def __init__(self, verify, cache=None):
+        self._verify = verify
+        # exp is at most an hour out for Firebase ID tokens
+        self.tokens = cache if cache is not None else TTLCache(
+            maxsize=int(os.getenv('FIREBASE_TOKEN_CACHE_SIZE', 10000)), ttl=3600)
+
+    def verify(self, id_token):
+        """:raises: whatever the underlying verifier raises for an invalid token"""
+        key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+        decoded = self.tokens.get(key)
+        now = time.time()
+        if decoded is not None and decoded.get('exp', 0) > now:
+            return decoded
+        decoded = self._verify(id_token)
+        remaining = decoded.get('exp', 0) - now
+        if remaining > 0:
+            self.tokens.set(key, decoded, ttl=remaining)
+        return decoded
@@ -0,0 +1,124 @@
+"""
+Atomic cart updates.
+
+Every operation is a single positional update on one cart line
+(`cart.$.quantity`), a `$pull`, or a `$push` guarded by `cart.id $ne`, so a
+write only carries the changed line item and two tabs editing the same cart
+cannot overwrite each other's changes.
+"""
+import uuid
+
+from pymongo import UpdateOne
+
+MAX_BULK_OPS = 100
+CART_PROJECTION = {'cart': 1, '_id': 0}
+
+
+class CartError(ValueError):
+    """Malformed cart operation."""
+
+
+def _set_quantity(email, item_id, quantity):
+    return UpdateOne({'email': email, 'cart.id': item_id}, {'$set': {'cart.$.quantity': quantity}})
+
+
+def _push_if_absent(email, item):
+    item = dict(item, key=str(uuid.uuid4()))
+    return UpdateOne({'email': email, 'cart.id': {'$ne': item['id']}}, {'$push': {'cart': item}})
+
+
+def _inc_quantity(email, item_id, delta):
+    return UpdateOne(*_inc_spec(email, item_id, delta))
+
+
+def _inc_spec(email, item_id, delta):
+    return {'email': email, 'cart.id': item_id}, {'$inc': {'cart.$.quantity': delta}}
+
+
+def _remove(email, item_id):
+    return UpdateOne(*_remove_spec(email, item_id))
+
+
+def _remove_spec(email, item_id):
+    return {'email': email}, {'$pull': {'cart': {'id': item_id}}}
+
+
+def upsert_ops(email, item):
+    """
+    Set the quantity of an item already in the cart, or add it.
+
+    Applied in order, exactly one of the two updates matches: the positional
+    $set if the item is there, otherwise the guarded $push.
+    """
+    if not isinstance(item, dict) or 'id' not in item:
+        raise CartError("Cart items need an id")
+    return [_set_quantity(email, item['id'], item.get('quantity', 1)), _push_if_absent(email, item)]
+
+
+def operation(email, op):
+    """
+    Translate one line-item change from the bulk endpoint into updates.
+
+    {"op": "add", "item": {...}}            add or set quantity
+    {"op": "set", "id": ..., "quantity": n}
+    {"op": "inc", "id": ..., "delta": n}    negative delta decreases
+    {"op": "remove", "id": ...}
+    """
+    if not isinstance(op, dict):
+        raise CartError("Each operation must be an object")
+    kind = op.get('op')
+    if kind == 'add':
+        return upsert_ops(email, op.get('item'))
+    if 'id' not in op:
+        raise CartError(f"'{kind}' needs an id")
+    if kind == 'set':
+        try:
+            return [_set_quantity(email, op['id'], int(op['quantity']))]
+        except (KeyError, TypeError, ValueError):
+            raise CartError("'set' needs an integer quantity")
+    if kind == 'inc':
+        try:
+            return [_inc_quantity(email, op['id'], int(op.get('delta', 1)))]
+        except (TypeError, ValueError):
+            raise CartError("'inc' needs an integer delta")
+    if kind == 'remove':
+        return [_remove(email, op['id'])]
+    raise CartError(f"Unknown cart operation: {kind}")
+
+
+def add_items(collection, email, items):
+    ops = [update for item in items for update in upsert_ops(email, item)]
+    if ops:
+        collection.bulk_write(ops, ordered=True)
+
+
+def increment(collection, email, item_id, delta):
+    return collection.update_one(*_inc_spec(email, item_id, delta)).modified_count > 0
+
+
+def remove(collection, email, item_id):
+    collection.update_one(*_remove_spec(email, item_id))
+
+
+def clear(collection, email):
+    collection.update_one({'email': email}, {'$set': {'cart': []}})
+
+
+def apply(collection, email, ops):
+    """
+    Apply many line-item changes in one ordered bulk_write.
+
+    :return: number of cart lines changed
+    """
+    if not isinstance(ops, list) or not ops:
+        raise CartError("ops must be a non-empty list")
+    if len(ops) > MAX_BULK_OPS:
+        raise CartError(f"At most {MAX_BULK_OPS} operations per request")
+    updates = [update for op in ops for update in operation(email, op)]
+    result = collection.bulk_write(updates, ordered=True)
+    return result.modified_count
+
+
+def get(collection, email):
+    doc = collection.find_one({'email': email}, CART_PROJECTION) or {}
+    return doc.get('cart', [])
@@ -0,0 +1,109 @@
+import csv
+from collections import namedtuple
+from types import MappingProxyType
+
+DiseaseInfo = namedtuple('DiseaseInfo', ['description', 'precautions', 'severity'])
+
+NO_DESCRIPTION = "No description available"
+UNKNOWN_DISEASE = DiseaseInfo(NO_DESCRIPTION, (), None)
+
+
+def _key(name):
+    # The CSVs are hand edited: trailing spaces ("Diabetes ") and doubled
+    # spaces ("Paroymsal  Positional") must not break the lookup
+    return ' '.join(name.split())
+
+
+def _read_rows(path):
+    with open(path, newline='', encoding='utf-8') as fp:
+        reader = csv.reader(fp)
+        next(reader, None)  # header
+        for row in reader:
+            if row and row[0].strip():
+                yield row
+
+
+def _symptom_weights(models_dir):
+    path = models_dir / 'Symptom-severity.csv'
+    if not path.exists():
+        return {}
+    weights = {}
+    for row in _read_rows(path):
+        try:
+            weights[_key(row[0]).replace(' ', '_')] = int(row[1])
+        except (IndexError, ValueError):
+            continue
+    return weights
+
+
+def _disease_severity(models_dir, weights):
+    """Severity of a disease = weight of the most severe symptom it presents with in dataset.csv."""
+    path = models_dir / 'dataset.csv'
+    if not weights or not path.exists():
+        return {}
+    severity = {}
+    for row in _read_rows(path):
+        disease = _key(row[0])
+        for symptom in row[1:]:
+            weight = weights.get(_key(symptom).replace(' ', '_'))
+            if weight is not None and weight > severity.get(disease, 0):
+                severity[disease] = weight
+    return severity
+
+
+def build_disease_index(models_dir):
+    """
+    Build the read-only disease -> DiseaseInfo lookup used to assemble /predict responses.
+
+    :param models_dir: directory holding symptom_Description.csv, symptom_precaution.csv,
+                       Symptom-severity.csv and dataset.csv
+    :return: immutable mapping of disease name to DiseaseInfo
+    """
+    descriptions = {}
+    for row in _read_rows(models_dir / 'symptom_Description.csv'):
+        descriptions.setdefault(_key(row[0]), row[1].strip() if len(row) > 1 else NO_DESCRIPTION)
+
+    precautions = {}
+    for row in _read_rows(models_dir / 'symptom_precaution.csv'):
+        cleaned = tuple(p.strip() for p in row[1:] if p and p.strip())
+        precautions.setdefault(_key(row[0]), cleaned)
+
+    severity = _disease_severity(models_dir, _symptom_weights(models_dir))
+
+    index = {}
+    for disease in set(descriptions) | set(precautions) | set(severity):
+        index[disease] = DiseaseInfo(
+            description=descriptions.get(disease, NO_DESCRIPTION),
+            precautions=precautions.get(disease, ()),
+            severity=severity.get(disease),
+        )
+    return DiseaseIndex(index)
+
+
+class DiseaseIndex:
+    """Immutable disease lookup; missing diseases resolve to an empty DiseaseInfo."""
+
+    __slots__ = ('_index',)
+
+    def __init__(self, index):
+        self._index = MappingProxyType(dict(index))
+
+    def get(self, disease):
+        info = self._index.get(disease)
+        if info is None:
+            info = self._index.get(_key(disease), UNKNOWN_DISEASE)
+        return info
+
+    def to_dict(self):
+        return {disease: [info.description, list(info.precautions), info.severity] for disease, info in self._index.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({disease: DiseaseInfo(description, tuple(precautions), severity)
+                    for disease, (description, precautions, severity) in data.items()})
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, disease):
+        return disease in self._index or _key(disease) in self._index
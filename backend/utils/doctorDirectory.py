@@ -0,0 +1,198 @@
+"""
+Doctor directory: index-backed filters, a projection limited to what a card
+shows, and _id cursor pagination.
+
+Fees are stored as numbers (parse_fee) so the fee range filter can use the
+index; documents written before that are converted once with
+    cd backend
+    python -m utils.doctorDirectory migrate-fees
+"""
+import argparse
+import json
+import os
+import sys
+
+import pymongo
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from utils.imagePipeline import CARD_THUMBNAIL
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Only what a doctor card needs: never the unbounded appointment, cart, order or wallet arrays
+DIRECTORY_PROJECTION = {
+    "_id": 1,
+    "email": 1,
+    "status": 1,
+    "username": 1,
+    "specialization": 1,
+    "gender": 1,
+    "phone": 1,
+    "meet": 1,
+    "appointments": 1,
+    "stars": 1,
+    "fee": 1,
+    "profile_picture": 1,
+    # Only the card-sized thumbnail, not every variant
+    f"profile_thumbnails.{CARD_THUMBNAIL}": 1,
+    "location": 1,
+}
+
+DIRECTORY_INDEXES = [
+    pymongo.IndexModel([("verified", 1), ("_id", 1)], name="directory_verified"),
+    pymongo.IndexModel([("verified", 1), ("specialization", 1), ("_id", 1)], name="directory_specialization"),
+    pymongo.IndexModel([("verified", 1), ("status", 1), ("_id", 1)], name="directory_status"),
+    pymongo.IndexModel([("verified", 1), ("fee", 1)], name="directory_fee"),
+]
+
+
+class DirectoryQueryError(ValueError):
+    """Invalid filter or cursor in a directory request."""
+
+
+def parse_fee(value):
+    """Store fees as numbers so fee range filters and the fee index work; leave non-numeric input untouched."""
+    if isinstance(value, (int, float)) or value in (None, ''):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def doctor_card(doc, card_id):
+    return {
+        "email": doc.get("email", ""),
+        "status": doc.get("status", "offline"),
+        "username": doc.get("username", "Unknown Doctor"),
+        "specialization": doc.get("specialization", "General Medicine"),
+        "gender": doc.get("gender", "male"),
+        "phone": doc.get("phone", ""),
+        "isInMeet": doc.get("meet", False),
+        "noOfAppointments": doc.get("appointments", 0),
+        "noOfStars": doc.get("stars", 0),
+        "id": card_id,
+        "fee": doc.get('fee', 199),
+        # Small thumbnail once generated, the full picture until then
+        "profilePicture": (doc.get("profile_thumbnails") or {}).get(CARD_THUMBNAIL) or doc.get("profile_picture", ""),
+        # Include location if available
+        "location": doc.get("location", None)
+    }
+
+
+def build_query(args, live_status=None):
+    """
+    Translate request args into an index-friendly Mongo filter.
+
+    :param args: mapping with optional specialization, status, fee_min, fee_max, cursor
+    :param live_status: optional callable, status -> emails that currently have it
+        according to live presence; Mongo's status is written behind and can lag
+    """
+    query = {"verified": True}
+    if args.get("specialization"):
+        query["specialization"] = args["specialization"]
+    if args.get("status"):
+        live = list(live_status(args["status"])) if live_status else []
+        if live:
+            query["$or"] = [{"status": args["status"]}, {"email": {"$in": live}}]
+        else:
+            query["status"] = args["status"]
+
+    fee = {}
+    for arg, op in (("fee_min", "$gte"), ("fee_max", "$lte")):
+        if args.get(arg) not in (None, ''):
+            try:
+                fee[op] = float(args[arg])
+            except (TypeError, ValueError):
+                raise DirectoryQueryError(f"{arg} must be a number")
+    if fee:
+        query["fee"] = fee
+
+    if args.get("cursor"):
+        try:
+            query["_id"] = {"$gt": ObjectId(args["cursor"])}
+        except (InvalidId, TypeError):
+            raise DirectoryQueryError("Invalid cursor")
+    return query
+
+
+def page_size(args):
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise DirectoryQueryError("limit must be an integer")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def stream_page(doctors, args, overlay=None, live_status=None):
+    """
+    Generator yielding one JSON document {"doctors": [...], "next_cursor": ...}
+    chunk by chunk, so the page is never materialised as one big list.
+    Validation happens before the first chunk so errors can still become a 400.
+
+    :param overlay: optional callable applied to each document (e.g. live presence)
+    :param live_status: see build_query(); with a status filter, documents whose
+        overlaid status no longer matches are skipped
+    """
+    query = build_query(args, live_status)
+    limit = page_size(args)
+    status = args.get("status")
+    recheck = bool(status and overlay)
+    cursor = doctors.find(query, DIRECTORY_PROJECTION).sort("_id", pymongo.ASCENDING)
+    # Without re-checking, one extra document only tells us there is a next page;
+    # with it, some documents may be skipped, so read on in batches instead
+    cursor = cursor.batch_size(limit + 1) if recheck else cursor.limit(limit + 1)
+
+    def generate():
+        yield '{"doctors":['
+        last_id = None
+        count = 0
+        for doc in cursor:
+            if overlay:
+                doc = overlay(doc)
+            if recheck and doc.get("status") != status:
+                continue
+            if count == limit:
+                break
+            last_id = doc["_id"]
+            yield ("," if count else "") + json.dumps(doctor_card(doc, str(last_id)), default=str)
+            count += 1
+        else:
+            last_id = None
+        yield '],"next_cursor":' + json.dumps(str(last_id) if last_id else None) + '}'
+
+    return generate()
+
+
+def migrate_fees(doctors):
+    """Convert fees stored as numeric strings to numbers. :return: (converted, left as is)"""
+    converted, skipped = 0, 0
+    for doc in doctors.find({"fee": {"$type": "string"}}, {"fee": 1}):
+        fee = parse_fee(doc["fee"])
+        if isinstance(fee, str):
+            skipped += 1
+            continue
+        # Only if the fee was not changed in the meantime
+        converted += doctors.update_one({"_id": doc["_id"], "fee": doc["fee"]}, {"$set": {"fee": fee}}).modified_count
+    return converted, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Doctor directory maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('migrate-fees', help='store numeric string fees as numbers')
+    parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv('DBURL')).get_database('telmedsphere')
+    converted, skipped = migrate_fees(db.doctors)
+    print(f"Fees: {converted} converted to numbers, {skipped} not numeric (left as is)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
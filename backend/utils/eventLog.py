@@ -0,0 +1,73 @@
+"""
+Structured logging: one JSON object per line on stderr, e.g.
+
+    {"ts": 1700000000.123, "level": "info", "logger": "telmedsphere.http",
+     "event": "request", "method": "POST", "endpoint": "/get_wallet", "status": 200, "ms": 4.1}
+
+High-volume events (one per request) pass `sample`, the fraction of them to
+keep; kept entries carry `sample_rate` so counts can be scaled back up.
+Errors and warnings are logged unsampled. LOG_LEVEL sets the threshold
+(INFO by default); LOG_SAMPLE_RATE is the default rate for sampled events.
+"""
+import json
+import logging
+import os
+import random
+import sys
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+ROOT = 'telmedsphere'
+SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _configure():
+    root = logging.getLogger(ROOT)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        root.addHandler(handler)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        root.propagate = False
+    return root
+
+
+_configure()
+
+
+def get_logger(name):
+    """:param name: component name; loggers live under "telmedsphere." """
+    return logging.getLogger(name if name.startswith(ROOT + '.') else f'{ROOT}.{name}')
+
+
+def event(logger, name, level=INFO, sample=None, exc_info=None, **fields):
+    """
+    Log `name` with `fields` as JSON keys.
+
+    :param sample: keep this fraction of calls (None = always log)
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample is not None:
+        if random.random() >= sample:
+            return
+        if sample < 1:
+            fields['sample_rate'] = sample
+    logger.log(level, name, exc_info=exc_info, extra={'fields': fields})
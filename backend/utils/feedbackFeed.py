@@ -0,0 +1,219 @@
+"""
+Public website feedback: a paginated, anonymized, cached feed and a rating
+summary maintained on insert.
+
+Pages are newest first by (timestamp, _id) with an opaque cursor. Anonymous
+entries lose `username`/`user_email` in the query projection itself, so they
+never leave the database. Pages and the summary are cached per worker for
+FEEDBACK_CACHE_TTL seconds (cleared on insert) and carry an ETag, so the
+testimonials widget polling the feed mostly gets 304s.
+
+Summary document (collection `feedback_summary`, _id "website"):
+    {count, rated, rating_total, ratings: {"5": n, ...}, types: {"<feedback_type>": n, ...}}
+Rebuild it from the feedback collection if it ever drifts:
+    cd backend
+    python -m utils.feedbackFeed rebuild-summary
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+
+import pymongo
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from utils.ttlCache import TTLCache
+
+SUMMARY_COLLECTION = 'feedback_summary'
+SUMMARY_ID = 'website'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Newest entries returned by the unpaginated GET /website_feedback (0 = all)
+LEGACY_LIMIT = int(os.getenv('FEEDBACK_LEGACY_LIMIT', 100))
+
+FEEDBACK_INDEXES = [
+    pymongo.IndexModel([('timestamp', -1), ('_id', -1)], name='feedback_feed'),
+]
+
+
+def _unless_anonymous(field):
+    return {'$cond': [{'$eq': ['$keep_it_anonymous', True]}, '$$REMOVE', f'${field}']}
+
+
+def _public_projection(include_id=False):
+    projection = {
+        'rating': 1,
+        'comments': 1,
+        'profile_picture': 1,
+        'keep_it_anonymous': 1,
+        'feedback_type': 1,
+        'timestamp': 1,
+        'username': _unless_anonymous('username'),
+        'user_email': _unless_anonymous('user_email'),
+    }
+    if not include_id:
+        projection['_id'] = 0
+    return projection
+
+
+FEED_PROJECTION = _public_projection(include_id=True)
+ENTRY_PROJECTION = _public_projection()
+
+cache = TTLCache(maxsize=256, ttl=float(os.getenv('FEEDBACK_CACHE_TTL', 30)))
+
+
+class FeedbackQueryError(ValueError):
+    """Invalid cursor, limit or feedback id."""
+
+
+def etag(payload):
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _encode_cursor(doc):
+    raw = json.dumps([doc.get('timestamp'), str(doc['_id'])]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        timestamp, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return timestamp, ObjectId(doc_id)
+    except (ValueError, TypeError, InvalidId):
+        raise FeedbackQueryError("Invalid cursor")
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise FeedbackQueryError("limit must be an integer")
+
+
+def _fetch_page(collection, limit, cursor):
+    query = {}
+    if cursor:
+        timestamp, doc_id = _decode_cursor(cursor)
+        query = {'$or': [{'timestamp': {'$lt': timestamp}}, {'timestamp': timestamp, '_id': {'$lt': doc_id}}]}
+    found = collection.find(query, FEED_PROJECTION).sort([('timestamp', -1), ('_id', -1)])
+    if limit:
+        found = found.limit(limit + 1)
+    docs = list(found)
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = _encode_cursor(docs[-1])
+    for doc in docs:
+        doc['id'] = str(doc.pop('_id'))
+    return {'feedback': docs, 'next_cursor': next_cursor}
+
+
+def feed_page(collection, limit, cursor=None):
+    """
+    :param limit: page size, or 0/None for everything
+    :return: ({"feedback": [...], "next_cursor": ...}, etag)
+    """
+    key = ('page', limit, cursor)
+    cached = cache.get(key)
+    if cached is None:
+        page = _fetch_page(collection, limit, cursor)
+        cached = (page, etag(page))
+        cache.set(key, cached)
+    return cached
+
+
+def entry(collection, feedback_id):
+    try:
+        object_id = ObjectId(feedback_id)
+    except (InvalidId, TypeError):
+        raise FeedbackQueryError("Invalid feedback id")
+    return collection.find_one({'_id': object_id}, ENTRY_PROJECTION)
+
+
+# ---- summary ----
+
+def _rating_key(rating):
+    try:
+        return str(int(round(float(rating))))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _type_key(feedback_type):
+    # Field names may not contain '.' or start with '$'
+    return (str(feedback_type or 'unspecified').replace('.', '_').lstrip('$')) or 'unspecified'
+
+
+def record(collection, summaries, feedback):
+    """Insert a feedback entry and fold it into the summary with one $inc."""
+    collection.insert_one(feedback)
+    increments = {'count': 1, f"types.{_type_key(feedback.get('feedback_type'))}": 1}
+    rating = _rating_key(feedback.get('rating'))
+    if rating is not None:
+        increments['rating_total'] = float(feedback['rating'])
+        increments['rated'] = 1
+        increments[f'ratings.{rating}'] = 1
+    # No upsert: a missing summary is rebuilt from the collection on first read,
+    # which already counts this entry
+    summaries.update_one({'_id': SUMMARY_ID}, {'$inc': increments})
+    cache.clear()
+
+
+def rebuild_summary(collection, summaries):
+    ratings, types = {}, {}
+    count, rated, rating_total = 0, 0, 0.0
+    for group in collection.aggregate([
+        {'$group': {'_id': {'rating': '$rating', 'type': '$feedback_type'}, 'n': {'$sum': 1}}},
+    ]):
+        n = group['n']
+        count += n
+        type_key = _type_key(group['_id'].get('type'))
+        types[type_key] = types.get(type_key, 0) + n
+        rating = _rating_key(group['_id'].get('rating'))
+        if rating is not None:
+            rated += n
+            rating_total += float(group['_id']['rating']) * n
+            ratings[rating] = ratings.get(rating, 0) + n
+    doc = {'count': count, 'rated': rated, 'rating_total': rating_total, 'ratings': ratings, 'types': types}
+    summaries.replace_one({'_id': SUMMARY_ID}, doc, upsert=True)
+    return doc
+
+
+def summary(collection, summaries):
+    """:return: ({count, average, ratings, types}, etag)"""
+    cached = cache.get('summary')
+    if cached is None:
+        doc = summaries.find_one({'_id': SUMMARY_ID}) or rebuild_summary(collection, summaries)
+        rated = doc.get('rated', 0)
+        payload = {
+            'count': doc.get('count', 0),
+            'average': round(doc.get('rating_total', 0) / rated, 2) if rated else None,
+            'ratings': doc.get('ratings', {}),
+            'types': doc.get('types', {}),
+        }
+        cached = (payload, etag(payload))
+        cache.set('summary', cached)
+    return cached
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Website feedback maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild-summary', help='recompute the rating summary from all feedback')
+    parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv('DBURL')).get_database('telmedsphere')
+    doc = rebuild_summary(db.website_feedback, db[SUMMARY_COLLECTION])
+    print(f"Summary rebuilt: {doc['count']} entries, {doc['rated']} rated")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Flat, array-backed version of a fitted tree ensemble (scikit-learn forests and
+multi-class XGBoost boosters).
+
+Export once (needs scikit-learn / xgboost):
+    python -m utils.flatForest export ../models/ExtraTrees
+
+This writes ../models/ExtraTrees.flat/ with one .npy file per array plus
+meta.json. Serving only needs NumPy: FlatForest.load() memory-maps the arrays,
+so gunicorn workers on one host share the same physical pages. See
+utils/modelArtifact.py for the single-file variant that also carries the
+symptom/disease tables.
+
+meta.json records the size and SHA-256 of the pickle it was exported from
+(`source`); the model registry ignores an export whose pickle has changed
+since, so replacing the pickle never leaves a stale export in charge.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'classes', 'tree_class')
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def flat_path(model_file):
+    model_file = Path(model_file)
+    return model_file.with_name(model_file.name + '.flat')
+
+
+def source_stamp(model_file):
+    """Identity of the pickle an export is built from."""
+    digest = hashlib.sha256()
+    with open(model_file, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return {'size': os.path.getsize(model_file), 'sha256': digest.hexdigest()}
+
+
+def is_current(meta, model_file):
+    """
+    False when the export was built from another version of `model_file`, or
+    predates source stamps. An export deployed without its pickle is trusted.
+    """
+    if not Path(model_file).exists():
+        return True
+    source = meta.get('source')
+    if not source or source.get('size') != os.path.getsize(model_file):
+        return False
+    return source == source_stamp(model_file)
+
+
+def _is_xgboost(model):
+    return hasattr(model, 'get_booster')
+
+
+def _estimators(model):
+    if hasattr(model, 'estimators_'):
+        return list(model.estimators_)
+    if hasattr(model, 'tree_'):
+        return [model]
+    raise TypeError(f'{type(model).__name__} is not a scikit-learn tree ensemble and cannot be flattened')
+
+
+def _plain_array(values):
+    # String labels come back from sklearn as object arrays, which np.save can't store without pickle
+    values = np.asarray(values)
+    return values.astype(str) if values.dtype == object else values
+
+
+def flatten(model):
+    """
+    Concatenate every tree of a fitted tree-ensemble classifier into contiguous arrays.
+
+    Forests ('forest' kind) average per-tree class probabilities. Boosted
+    models ('boosted' kind) sum per-class leaf margins and apply a softmax.
+    """
+    if _is_xgboost(model):
+        return _flatten_xgboost(model)
+    return _flatten_forest(model)
+
+
+def _flatten_forest(model):
+    """
+    Concatenate every tree of a fitted scikit-learn forest classifier into contiguous arrays.
+
+    Children indices are made absolute; leaves point at themselves so a fixed
+    number of traversal steps always ends on a leaf. Leaf values are stored as
+    class probabilities, exactly what each tree's predict_proba returns.
+    """
+    trees = [est.tree_ for est in _estimators(model)]
+    if any(t.n_outputs != 1 for t in trees):
+        raise TypeError('Multi-output forests are not supported')
+
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in trees:
+        n = tree.node_count
+        idx = np.arange(n, dtype=np.int32) + offset
+        is_leaf = tree.children_left == -1
+        left.append(np.where(is_leaf, idx, tree.children_left + offset).astype(np.int32))
+        right.append(np.where(is_leaf, idx, tree.children_right + offset).astype(np.int32))
+        feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        counts = tree.value[:, 0, :].astype(np.float64)
+        totals = counts.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        value.append((counts / totals).astype(np.float32))
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, int(tree.max_depth))
+
+    arrays = {
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'left': np.concatenate(left),
+        'right': np.concatenate(right),
+        'value': np.concatenate(value),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'classes': _plain_array(getattr(model, 'classes_', np.arange(value[0].shape[1]))),
+        'tree_class': np.zeros(len(trees), dtype=np.int32),
+    }
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'kind': 'forest',
+        'strict_split': False,
+        'source': type(model).__name__,
+        'n_trees': len(trees),
+        'n_nodes': offset,
+        'n_features': int(getattr(model, 'n_features_in_', trees[0].n_features)),
+        'n_classes': int(arrays['value'].shape[1]),
+        'max_depth': max_depth,
+    }
+    return FlatForest(arrays, meta)
+
+
+def _flatten_xgboost(model):
+    """
+    Flatten a multi-class XGBClassifier (multi:softprob / multi:softmax).
+
+    Tree i of the dump scores class i % n_classes. XGBoost sends a row left
+    when value < split_condition, hence strict_split. Missing values are not
+    supported (the symptom features are always 0/1).
+    """
+    booster = model.get_booster()
+    n_classes = int(getattr(model, 'n_classes_', 0))
+    if n_classes < 3:
+        raise TypeError('Only multi-class XGBoost models can be flattened')
+    dumps = booster.get_dump(dump_format='json')
+    if len(dumps) % n_classes:
+        raise TypeError('XGBoost models with num_parallel_tree > 1 are not supported')
+    names = booster.feature_names or []
+    columns = {name: i for i, name in enumerate(names)}
+
+    def column(split):
+        if split in columns:
+            return columns[split]
+        return int(split.lstrip('f'))
+
+    feature, threshold, left, right, value, roots, tree_class = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for t, dump in enumerate(dumps):
+        nodes = {}
+        stack = [(json.loads(dump), 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes[node['nodeid']] = node
+            max_depth = max(max_depth, depth)
+            stack.extend((child, depth + 1) for child in node.get('children', []))
+        # XGBoost node ids are dense per tree, so they can be used as local offsets
+        for nodeid in range(len(nodes)):
+            node = nodes[nodeid]
+            if 'leaf' in node:
+                feature.append(0)
+                threshold.append(np.inf)
+                left.append(offset + nodeid)
+                right.append(offset + nodeid)
+                value.append(node['leaf'])
+            else:
+                feature.append(column(node['split']))
+                threshold.append(node['split_condition'])
+                left.append(offset + node['yes'])
+                right.append(offset + node['no'])
+                value.append(0.0)
+        roots.append(offset)
+        tree_class.append(t % n_classes)
+        offset += len(nodes)
+
+    arrays = {
+        'feature': np.asarray(feature, dtype=np.int32),
+        'threshold': np.asarray(threshold, dtype=np.float64),
+        'left': np.asarray(left, dtype=np.int32),
+        'right': np.asarray(right, dtype=np.int32),
+        'value': np.asarray(value, dtype=np.float32)[:, None],
+        'roots': np.asarray(roots, dtype=np.int32),
+        'classes': _plain_array(getattr(model, 'classes_', np.arange(n_classes))),
+        'tree_class': np.asarray(tree_class, dtype=np.int32),
+    }
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'kind': 'boosted',
+        'strict_split': True,
+        'source': type(model).__name__,
+        'n_trees': len(roots),
+        'n_nodes': offset,
+        'n_features': int(getattr(model, 'n_features_in_', len(names))),
+        'n_classes': n_classes,
+        'max_depth': max_depth,
+    }
+    return FlatForest(arrays, meta)
+
+
+class FlatForest:
+    """Pure-NumPy predictor over flattened trees; a drop-in for predict_proba."""
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.classes_ = arrays['classes']
+        self.tree_class = arrays['tree_class']
+        self.n_features_in_ = meta['n_features']
+        self.n_classes = meta['n_classes']
+        self.max_depth = meta['max_depth']
+        self.kind = meta.get('kind', 'forest')
+        self.strict_split = meta.get('strict_split', False)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows = X.shape[0]
+        rows = np.arange(n_rows)[:, None]
+        # (n_rows, n_trees) cursor, every tree of every row advanced in lock step
+        nodes = np.broadcast_to(self.roots, (n_rows, self.roots.shape[0])).copy()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]]
+            go_left = x < self.threshold[nodes] if self.strict_split else x <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        if self.kind == 'boosted':
+            # Trees are stored round by round (tree i scores class i % n_classes)
+            margins = self.value[nodes, 0].astype(np.float64).reshape(n_rows, -1, self.n_classes).sum(axis=1)
+            margins -= margins.max(axis=1, keepdims=True)
+            expd = np.exp(margins)
+            return expd / expd.sum(axis=1, keepdims=True)
+        return self.value[nodes].mean(axis=1, dtype=np.float64)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(path / f'{name}.npy', np.ascontiguousarray(self.arrays[name]), allow_pickle=False)
+        # meta.json is written last: its presence (and mtime) marks a complete export
+        tmp = path / (META_FILE + '.tmp')
+        tmp.write_text(json.dumps(self.meta, indent=2))
+        os.replace(tmp, path / META_FILE)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        meta = json.loads((path / META_FILE).read_text())
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported flat forest format {meta.get('format_version')}")
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode=mode, allow_pickle=False)
+                  for name in ARRAYS if (path / f'{name}.npy').exists()}
+        arrays.setdefault('tree_class', np.zeros(len(arrays['roots']), dtype=np.int32))
+        return cls(arrays, meta)
+
+
+def check(model, flat, n_samples=2000, density=0.03, seed=0):
+    """Largest absolute predict_proba difference on random sparse 0/1 rows."""
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_samples, flat.n_features_in_)) < density).astype(np.float32)
+    return float(np.max(np.abs(model.predict_proba(X) - flat.predict_proba(X))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a pickled tree ensemble to flat NumPy arrays')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export')
+    export.add_argument('model', help='pickled tree ensemble, e.g. ../models/ExtraTrees or ../models/XGBoost')
+    export.add_argument('--out', help='output directory (default: <model>.flat)')
+    export.add_argument('--tolerance', type=float, default=1e-6)
+    args = parser.parse_args(argv)
+
+    with open(args.model, 'rb') as fp:
+        model = pickle.load(fp)
+    flat = flatten(model)
+    error = check(model, flat)
+    if error > args.tolerance:
+        print(f'Flattened model differs from the original by {error:.3g} (> {args.tolerance})')
+        return 1
+    flat.meta['source'] = source_stamp(args.model)
+    out = Path(args.out) if args.out else flat_path(args.model)
+    flat.save(out)
+    print(f"Exported {flat.meta['n_trees']} trees / {flat.meta['n_nodes']} nodes to {out} (max abs diff {error:.3g})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Compression and conditional requests for JSON (and other text) responses.
+
+init_app(app) installs an after_request hook that, for buffered 200 responses:
+
+    * gives GET/HEAD responses a strong ETag: a BLAKE2 digest of the body
+      unless the route already set one, suffixed per content-coding
+      ("<tag>-gzip", "<tag>-br");
+    * answers 304 Not Modified when If-None-Match carries that tag;
+    * compresses bodies of at least COMPRESS_MIN_SIZE bytes with brotli (when
+      the optional `brotli` package is installed) or gzip, as negotiated by
+      Accept-Encoding.
+
+Streamed responses (SSE, the /doctors stream, files) pass through untouched.
+Other methods are only compressed: 304 is defined for GET/HEAD only, and
+since browsers never cache POST responses a 304 would reach the page as an
+empty body. Read-only POST routes such as /get_wallet get no ETags until
+they move to GET.
+
+@versioned(tag) goes further for routes whose content is fully described by
+version counters: the tag is computed before the route runs, so an unchanged
+resource costs neither the query nor the serialization. DataVersions keeps
+such counters in Mongo so every worker sees the same version.
+"""
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from flask import Response, make_response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+# Low brotli quality: most of the size win at a fraction of the CPU for dynamic responses
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+_COMPRESSIBLE = ('application/json', 'application/javascript', 'application/x-yaml', 'image/svg+xml')
+_CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+class DataVersions:
+    """Named version counters shared by all workers (collection `data_versions`)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def bump(self, name):
+        self.collection.update_one({'_id': name}, {'$inc': {'v': 1}}, upsert=True)
+
+    def get(self, name):
+        doc = self.collection.find_one({'_id': name}, {'v': 1})
+        return doc['v'] if doc else 0
+
+
+def versioned(tag):
+    """
+    :param tag: zero-argument callable returning a string that changes whenever
+                the route's response would, or None to fall back to hashing
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            base = tag()
+            if base is None:
+                return view(*args, **kwargs)
+            base = hashlib.blake2b(f"{request.full_path}|{base}".encode('utf-8'), digest_size=16).hexdigest()
+            if _eligible() and _matches(base):
+                return _not_modified(base, _encoding())
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(base)
+            return response
+        return wrapper
+    return decorator
+
+
+def _eligible():
+    return request.method in _CONDITIONAL_METHODS
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in _COMPRESSIBLE
+
+
+def _encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def _tag(base, encoding):
+    return f"{base}-{encoding}" if encoding else base
+
+
+def _matches(base):
+    tags = request.if_none_match
+    if not tags:
+        return False
+    # Every coding of the same content counts as a match
+    return tags.star_tag or any(tags.contains(_tag(base, encoding)) for encoding in (None, 'gzip', 'br'))
+
+
+def _not_modified(base, encoding):
+    response = Response(status=304)
+    response.set_etag(_tag(base, encoding))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def finish(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or not _compressible(response) or 'Content-Encoding' in response.headers):
+        return response
+
+    data = response.get_data()
+    encoding = _encoding() if len(data) >= MIN_SIZE else None
+    response.vary.add('Accept-Encoding')
+
+    if _eligible():
+        base, weak = response.get_etag()
+        if base is None or weak:
+            base = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if _matches(base):
+            return _not_modified(base, encoding)
+        response.set_etag(_tag(base, encoding))
+        if 'Cache-Control' not in response.headers:
+            # Browsers may keep the response but must revalidate it (cheap with the ETag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+
+    if encoding:
+        response.set_data(_compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(finish)
@@ -0,0 +1,176 @@
+"""
+Profile picture preprocessing, run before anything reaches the object store.
+
+    prepare()      validate (size, signature, pixel count), apply the EXIF
+                   orientation, drop EXIF/GPS and other metadata, downscale to
+                   IMAGE_MAX_DIMENSION and recompress (JPEG, or PNG when the
+                   picture has transparency)
+    thumbnails()   fixed square variants (THUMBNAIL_SIZES) for cards and lists
+
+Thumbnails are generated on a small background pool after the user document
+is written and recorded as `profile_thumbnails` ({"160": url, ...}); the
+doctor directory serves the card-sized one.
+
+Pillow is optional: without it uploads are still validated, but stored as sent
+and no thumbnails are generated.
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import eventLog
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+MAX_UPLOAD_BYTES = int(os.getenv('IMAGE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 1024))
+MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+QUALITY = int(os.getenv('IMAGE_QUALITY', 82))
+THUMBNAIL_SIZES = (64, 160, 320)
+CARD_THUMBNAIL = '160'
+THUMBNAIL_FOLDER = 'TelMedSphere/thumbnails'
+
+log = eventLog.get_logger('images')
+
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class ImageError(ValueError):
+    """The upload is not an acceptable image."""
+
+
+class PreparedImage:
+    def __init__(self, data, content_type, width=None, height=None):
+        self.data = data
+        self.content_type = content_type
+        self.width = width
+        self.height = height
+
+    @property
+    def filename(self):
+        return 'profile' + {'image/jpeg': '.jpg', 'image/png': '.png',
+                            'image/gif': '.gif', 'image/webp': '.webp'}[self.content_type]
+
+
+def sniff(data):
+    """Content type from the file signature; the client's filename and mimetype are not trusted."""
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    raise ImageError("Profile picture must be a JPEG, PNG, GIF or WebP image")
+
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def _encode(img):
+    """Re-encode without EXIF or other metadata (only the colour profile is kept)."""
+    out = io.BytesIO()
+    icc_profile = img.info.get('icc_profile')
+    extra = {'icc_profile': icc_profile} if icc_profile else {}
+    if _has_alpha(img):
+        img.convert('RGBA').save(out, 'PNG', optimize=True, **extra)
+        content_type = 'image/png'
+    else:
+        img.convert('RGB').save(out, 'JPEG', quality=QUALITY, optimize=True, progressive=True, **extra)
+        content_type = 'image/jpeg'
+    return PreparedImage(out.getvalue(), content_type, img.width, img.height)
+
+
+def _open(data):
+    img = Image.open(io.BytesIO(data))
+    if img.width * img.height > MAX_PIXELS:
+        raise ImageError("Profile picture dimensions are too large")
+    # JPEGs can be decoded at a fraction of their size, which is much cheaper
+    img.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))
+    img.load()
+    return ImageOps.exif_transpose(img)
+
+
+def prepare(data):
+    """
+    :raises ImageError: empty, oversized, unsupported or corrupt upload
+    :return: PreparedImage ready for the object store
+    """
+    if not data:
+        raise ImageError("Profile picture is empty")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ImageError(f"Profile picture must be smaller than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    content_type = sniff(data)
+    if Image is None:
+        return PreparedImage(data, content_type)
+
+    try:
+        img = _open(data)
+        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+        return _encode(img)
+    except ImageError:
+        raise
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError("Profile picture could not be read") from e
+
+
+def thumbnails(prepared):
+    """:return: {size: PreparedImage} square crops, empty without Pillow"""
+    if Image is None:
+        return {}
+    source = Image.open(io.BytesIO(prepared.data))
+    source.load()
+    variants = {}
+    for size in THUMBNAIL_SIZES:
+        variants[size] = _encode(ImageOps.fit(source, (size, size), Image.LANCZOS))
+    return variants
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_WORKERS', 2)),
+                                               thread_name_prefix='thumbnails')
+    return _executor
+
+
+def store_thumbnails(media, collection, email, picture_url, prepared, on_stored=None):
+    """
+    Generate and store thumbnails in the background, then record their URLs on
+    the user document, but only if `picture_url` is still the current picture
+    (a later update must not get an older picture's thumbnails).
+
+    :param on_stored: optional callable run once the URLs are recorded
+    """
+    if Image is None:
+        return None
+
+    def run():
+        try:
+            urls = {
+                str(size): media.put(variant.data, folder=THUMBNAIL_FOLDER, filename=variant.filename,
+                                     content_type=variant.content_type)
+                for size, variant in thumbnails(prepared).items()
+            }
+            result = collection.update_one({'email': email, 'profile_picture': picture_url},
+                                           {'$set': {'profile_thumbnails': urls}})
+            if on_stored and result.modified_count:
+                on_stored()
+        except Exception as e:
+            eventLog.event(log, 'thumbnails_failed', level=eventLog.ERROR, email=email, error=str(e))
+
+    return _pool().submit(run)
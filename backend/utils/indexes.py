@@ -0,0 +1,206 @@
+"""
+Index manifest for every collection the Flask backend queries, and a
+query-plan checker for the query shapes it issues.
+
+The index specs stay next to the code that relies on them (directory,
+appointments, users, ledger); MANIFEST only gathers them per collection.
+apply() is idempotent: existing indexes are left alone, an index whose
+options changed (e.g. email becoming unique) is rebuilt, and a unique index
+that cannot be built because of duplicate values is reported, not forced.
+
+`apply` exits with status 1 when an index is blocked. build.sh deliberately
+only warns and deploys anyway: the app works without the index (register()
+falls back to its check-then-insert, a race it no longer closes), and the
+duplicates have to be merged by hand before a later deploy can build it.
+Unique user emails are enforced per collection; see USER_INDEXES.
+
+    cd backend
+    python -m utils.indexes apply            # create/upgrade indexes (build.sh runs this)
+    python -m utils.indexes apply --dry-run  # only show what would change
+    python -m utils.indexes explain          # flag query shapes planned as a COLLSCAN
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+import pymongo
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from utils import appointments, walletLedger
+from utils.feedbackFeed import FEEDBACK_INDEXES
+from utils.doctorDirectory import DIRECTORY_INDEXES
+from utils.userDirectory import USER_INDEXES
+
+DATABASE = 'telmedsphere'
+
+# reset_password() looks users up by token and expiry; only users mid-reset have them
+RESET_INDEXES = [
+    pymongo.IndexModel([('reset_token', 1), ('reset_token_expiration', 1)], name='user_reset_token', sparse=True),
+]
+
+MANIFEST = {
+    'patients': USER_INDEXES + RESET_INDEXES,
+    'doctors': USER_INDEXES + RESET_INDEXES + DIRECTORY_INDEXES,
+    appointments.COLLECTION: appointments.APPOINTMENT_INDEXES,
+    walletLedger.COLLECTION: walletLedger.LEDGER_INDEXES,
+    'website_feedback': FEEDBACK_INDEXES,
+}
+
+# createIndexes error codes for "an index with this name/key exists with other options"
+_CONFLICT_CODES = (85, 86)
+
+_EMAIL = 'probe@example.com'
+_NOW = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_OID = ObjectId('000000000000000000000000')
+
+# (description, collection, filter, sort): the filters the routes and helpers
+# send, with placeholder values; the plan only depends on the shape
+QUERY_SHAPES = [
+    ('user by email', 'patients', {'email': _EMAIL}, None),
+    ('user by email', 'doctors', {'email': _EMAIL}, None),
+    ('names for emails', 'patients', {'email': {'$in': [_EMAIL]}}, None),
+    ('reset token', 'patients', {'reset_token': 'token', 'reset_token_expiration': {'$gt': _NOW}}, None),
+    ('reset token', 'doctors', {'reset_token': 'token', 'reset_token_expiration': {'$gt': _NOW}}, None),
+    ('verified doctors', 'doctors', {'verified': True}, [('_id', 1)]),
+    ('directory by specialization', 'doctors', {'verified': True, 'specialization': 'Cardiology'}, [('_id', 1)]),
+    ('directory by status', 'doctors', {'verified': True, 'status': 'online'}, [('_id', 1)]),
+    ('directory by live status', 'doctors', {'verified': True, '$or': [{'status': 'online'}, {'email': {'$in': [_EMAIL]}}]},
+     [('_id', 1)]),
+    ('directory by fee', 'doctors', {'verified': True, 'fee': {'$gte': 0, '$lte': 500}}, None),
+    ('appointment by link', appointments.COLLECTION, {'link': 'link'}, None),
+    ('complete appointment', appointments.COLLECTION,
+     {'link': 'link', 'pemail': _EMAIL, 'demail': _EMAIL, 'status': appointments.UPCOMING}, None),
+    ('doctor upcoming', appointments.COLLECTION, {'demail': _EMAIL, 'status': appointments.UPCOMING},
+     [('date', 1), ('time', 1)]),
+    ('patient upcoming', appointments.COLLECTION, {'pemail': _EMAIL, 'status': appointments.UPCOMING},
+     [('date', 1), ('time', 1)]),
+    ('completed meets', appointments.COLLECTION,
+     appointments.completed_query('pemail', _EMAIL, {'date_from': '2000-01-01', 'date_to': '2000-12-31'}),
+     [('date', 1), ('time', 1)]),
+    ('wallet history', walletLedger.COLLECTION, {'email': _EMAIL, 'kind': walletLedger.HISTORY}, [('_id', 1)]),
+    ('feedback feed', 'website_feedback', {'$or': [{'timestamp': {'$lt': 'ts'}}, {'timestamp': 'ts', '_id': {'$lt': _OID}}]},
+     [('timestamp', -1), ('_id', -1)]),
+    ('wallet checkpoint', walletLedger.COLLECTION, {'email': _EMAIL, 'kind': walletLedger.CHECKPOINT}, [('_id', -1)]),
+]
+
+
+def _key(spec):
+    return list(spec.items())
+
+
+def _duplicates(collection, keys, limit=5):
+    group = {'_id': {field: f'${field}' for field, _ in keys}, 'count': {'$sum': 1}}
+    return list(collection.aggregate([
+        {'$match': {field: {'$exists': True} for field, _ in keys}},
+        {'$group': group},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': limit},
+    ], allowDiskUse=True))
+
+
+def _apply_one(collection, model, dry_run, log):
+    spec = model.document
+    existing = collection.index_information()
+    matching = [name for name, info in existing.items()
+                if name == spec['name'] or list(info['key']) == _key(spec['key'])]
+    if dry_run:
+        log(f"{collection.name}: {'check' if matching else 'create'} {spec['name']}")
+        return 'checked' if matching else 'created'
+    try:
+        collection.create_indexes([model])
+        return 'checked' if matching else 'created'
+    except OperationFailure as e:
+        if e.code not in _CONFLICT_CODES:
+            raise
+
+    # Same name or keys with other options: rebuild, unless a unique build would fail
+    if spec.get('unique'):
+        duplicates = _duplicates(collection, _key(spec['key']))
+        if duplicates:
+            log(f"{collection.name}: cannot make {spec['name']} unique, duplicate values e.g. "
+                f"{[d['_id'] for d in duplicates]}")
+            return 'blocked'
+    for name in matching:
+        collection.drop_index(name)
+    collection.create_indexes([model])
+    log(f"{collection.name}: rebuilt {spec['name']} (was {', '.join(matching)})")
+    return 'rebuilt'
+
+
+def apply(db, dry_run=False, log=print):
+    """
+    Create or upgrade every index in MANIFEST.
+
+    :return: counts per outcome (created, checked, rebuilt, blocked)
+    """
+    totals = {'created': 0, 'checked': 0, 'rebuilt': 0, 'blocked': 0}
+    for name, models in MANIFEST.items():
+        collection = db[name]
+        for model in models:
+            totals[_apply_one(collection, model, dry_run, log)] += 1
+        declared = {model.document['name'] for model in models} | {'_id_'}
+        unmanaged = set(collection.index_information()) - declared
+        if unmanaged:
+            log(f"{name}: indexes not in the manifest: {', '.join(sorted(unmanaged))}")
+    return totals
+
+
+def _stages(plan):
+    """Every stage name in a (classic or SBE) query plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan', 'thenStage', 'elseStage', 'outerStage', 'innerStage'):
+        yield from _stages(plan.get(key))
+    for child in plan.get('inputStages', ()):
+        yield from _stages(child)
+
+
+def explain(db, log=print):
+    """
+    Plan every query shape and report the ones that scan the whole collection.
+
+    :return: list of (description, collection, stages) for collection scans
+    """
+    scans = []
+    for description, name, query, sort in QUERY_SHAPES:
+        command = {'find': name, 'filter': query}
+        if sort:
+            command['sort'] = dict(sort)
+        result = db.command('explain', command, verbosity='queryPlanner')
+        stages = list(_stages(result['queryPlanner']['winningPlan']))
+        flag = 'COLLSCAN' in stages
+        log(f"{'COLLSCAN' if flag else 'ok':<8} {name:<18} {description}: {' <- '.join(stages)}")
+        if flag:
+            scans.append((description, name, stages))
+    return scans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mongo index manifest and query-plan checker')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('apply', help='create or upgrade the indexes in the manifest')
+    run.add_argument('--dry-run', action='store_true')
+    sub.add_parser('explain', help='explain every query shape and flag collection scans')
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv('DBURL')).get_database(DATABASE)
+
+    if args.command == 'apply':
+        totals = apply(db, dry_run=args.dry_run)
+        print(f"Indexes: {totals['created']} created, {totals['rebuilt']} rebuilt, "
+              f"{totals['checked']} already present, {totals['blocked']} blocked")
+        return 1 if totals['blocked'] else 0
+
+    scans = explain(db)
+    print(f"{len(scans)} of {len(QUERY_SHAPES)} query shapes use a collection scan")
+    return 1 if scans else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class SchedulerBusy(Exception):
+    """Raised when the inference queue is full."""
+
+
+class InferenceBatcher:
+    """
+    Micro-batching scheduler in front of a predict_proba style function.
+
+    Request threads submit single feature rows and block on a Future. One
+    background thread takes the first queued row, keeps collecting for up to
+    `max_wait_ms` (or until `max_batch_size` rows are queued), scores the
+    whole batch with one vectorized call and fans the rows back out.
+
+    Each row is submitted with the `context` it was encoded for (the model
+    bundle); rows of different contexts are scored separately, as
+    `predict_fn(X, context)`, so a hot-swap never scores a row with a model
+    whose feature columns it was not built for.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=None, max_wait_ms=None, max_queue=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size or os.getenv('INFERENCE_MAX_BATCH', 32))
+        self.max_wait = float(max_wait_ms if max_wait_ms is not None else os.getenv('INFERENCE_MAX_WAIT_MS', 2)) / 1000.0
+        self._queue = queue.Queue(maxsize=int(max_queue or os.getenv('INFERENCE_QUEUE_SIZE', 1024)))
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._rejected = 0
+        self._max_batch_seen = 0
+        self._last_batch_ms = 0.0
+        self._histogram = dict.fromkeys(BATCH_SIZE_BUCKETS + ('+Inf',), 0)
+
+    def submit(self, row, context=None):
+        """Queue one 1-D feature row; the returned Future resolves to its probability row."""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((row, context, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise SchedulerBusy('Prediction queue is full, please retry shortly')
+        return future
+
+    def predict(self, row, context=None, timeout=30):
+        return self.submit(row, context).result(timeout=timeout)
+
+    def metrics(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self._batches,
+                'rows': self._rows,
+                'rejected': self._rejected,
+                'avg_batch_size': round(self._rows / self._batches, 3) if self._batches else 0.0,
+                'max_batch_seen': self._max_batch_seen,
+                'last_batch_ms': round(self._last_batch_ms, 3),
+                'batch_size_histogram': {str(k): v for k, v in self._histogram.items()},
+            }
+
+    def _ensure_started(self):
+        # Started lazily so the thread is created inside the gunicorn worker, not before fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Window closed: still take whatever is already queued
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Skip rows whose caller already gave up (Future cancelled)
+            groups = {}
+            for row, context, future in self._collect():
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(id(context), (context, []))[1].append((row, future))
+            for context, live in groups.values():
+                self._score(context, live)
+
+    def _score(self, context, live):
+        rows = [row for row, _ in live]
+        futures = [future for _, future in live]
+        started = time.perf_counter()
+        try:
+            proba = self.predict_fn(np.vstack(rows), context)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, proba_row in zip(futures, proba):
+            future.set_result(proba_row)
+        self._record(len(rows), (time.perf_counter() - started) * 1000.0)
+
+    def _record(self, size, elapsed_ms):
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._last_batch_ms = elapsed_ms
+            for bucket in BATCH_SIZE_BUCKETS:
+                if size <= bucket:
+                    self._histogram[bucket] += 1
+                    break
+            else:
+                self._histogram['+Inf'] += 1
@@ -0,0 +1,95 @@
+"""
+Third-party integrations initialized on first use instead of at import time.
+
+Importing stripe, twilio and firebase_admin and building their clients costs
+a noticeable share of a cold start, and most requests never touch them. Each
+integration is a Lazy whose factory runs once, on the first .get(), and is
+timed by the startup profiler.
+"""
+import os
+import threading
+
+from utils import eventLog
+from utils.startupProfiler import profiler
+
+log = eventLog.get_logger('integrations')
+
+_UNSET = object()
+
+
+class Lazy:
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    with profiler.phase(self.name):
+                        self._value = self._factory()
+        return self._value
+
+    __call__ = get
+
+    @property
+    def initialized(self):
+        return self._value is not _UNSET
+
+
+def _stripe():
+    import stripe
+    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+    return stripe
+
+
+def _twilio():
+    account_sid = os.getenv("TWILIO_WHATSAPP_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_WHATSAPP_AUTH_TOKEN")
+    if not (account_sid and auth_token):
+        eventLog.event(log, 'integration_disabled', level=eventLog.WARNING, integration='twilio',
+                       reason='TWILIO_WHATSAPP_ACCOUNT_SID/TWILIO_WHATSAPP_AUTH_TOKEN not set')
+        return None
+    from twilio.rest import Client
+    return Client(account_sid, auth_token)
+
+
+def _firebase_auth():
+    import firebase_admin
+    from firebase_admin import auth, credentials
+
+    private_key = os.getenv("FIREBASE_PRIVATE_KEY")
+    if not private_key:
+        eventLog.event(log, 'integration_disabled', level=eventLog.WARNING, integration='firebase',
+                       reason='FIREBASE_PRIVATE_KEY not set')
+        return auth
+    config = {
+        "type": os.getenv("FIREBASE_TYPE"),
+        "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+        "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+        "private_key": private_key.replace('\\n', '\n'),
+        "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+        "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+        "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
+        "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
+        "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_CERT_URL"),
+        "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL"),
+        "universe_domain": os.getenv("FIREBASE_UNIVERSE_DOMAIN"),
+    }
+    try:
+        firebase_admin.initialize_app(credentials.Certificate(config))
+        eventLog.event(log, 'integration_ready', integration='firebase')
+    except Exception as e:
+        eventLog.event(log, 'integration_failed', level=eventLog.ERROR, integration='firebase', error=str(e))
+    return auth
+
+
+stripe_api = Lazy('stripe', _stripe)
+twilio_client = Lazy('twilio', _twilio)
+firebase_auth = Lazy('firebase', _firebase_auth)
+
+
+def verify_firebase_token(id_token):
+    return firebase_auth.get().verify_id_token(id_token)
@@ -0,0 +1,99 @@
+import os
+import re
+
+from utils.appointments import APPOINTMENT_PROJECTION, completed_query
+from utils.ttlCache import TTLCache
+
+MAX_PAGE_SIZE = 200
+UNKNOWN_NAME = 'Unknown'
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# email -> username, shared by every request in the worker. Names change rarely
+# (update_details evicts them) so a short TTL is enough to bound staleness.
+name_cache = TTLCache(
+    maxsize=int(os.getenv('NAME_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('NAME_CACHE_TTL', 300)),
+)
+
+
+class MeetHistoryQueryError(ValueError):
+    """Invalid pagination or date filter in a completed meets request."""
+
+
+def forget_name(email):
+    name_cache.pop(email)
+
+
+def resolve_names(collection, emails):
+    """
+    Map emails to usernames with at most one `$in` query for the cache misses.
+
+    :param collection: doctors or patients
+    :param emails: iterable of emails, duplicates and empty values allowed
+    """
+    names = {}
+    missing = []
+    for email in set(e for e in emails if e):
+        name = name_cache.get(email)
+        if name is None:
+            missing.append(email)
+        else:
+            names[email] = name
+    if missing:
+        found = {doc['email']: doc.get('username', UNKNOWN_NAME)
+                 for doc in collection.find({'email': {'$in': missing}}, {'email': 1, 'username': 1, '_id': 0})}
+        for email in missing:
+            names[email] = found.get(email, UNKNOWN_NAME)
+            # Unknown users are cached too, otherwise every page view would ask again
+            name_cache.set(email, names[email])
+    return names
+
+
+def parse_filters(data):
+    """
+    Validate offset/limit/date_from/date_to from the request body.
+
+    Dates are compared as "YYYY-MM-DD" strings, the format appointments are stored in.
+    A missing limit keeps the old behaviour of returning the whole history.
+    """
+    try:
+        offset = max(0, int(data.get('offset', 0)))
+        limit = data.get('limit')
+        limit = None if limit in (None, '') else max(1, min(int(limit), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise MeetHistoryQueryError("offset and limit must be integers")
+
+    dates = {}
+    for key in ('date_from', 'date_to'):
+        value = data.get(key)
+        if value in (None, ''):
+            continue
+        if not isinstance(value, str) or not _DATE.match(value):
+            raise MeetHistoryQueryError(f"{key} must be a YYYY-MM-DD date")
+        dates[key] = value
+    return offset, limit, dates
+
+
+def completed_page(appointments, others, role_field, email, name_field, other_email_field, offset, limit, dates):
+    """
+    One page of a user's completed meets with the counterpart's name attached.
+
+    The page comes from an indexed (email, date) range query, then all names on
+    it are resolved together, so a page costs a fixed number of round trips
+    regardless of how long the history is.
+
+    :param role_field: "demail" for a doctor's history, "pemail" for a patient's
+    :return: {"completedMeets": [...], "total": n, "offset": ..., "limit": ...}
+    """
+    query = completed_query(role_field, email, dates)
+    cursor = appointments.find(query, APPOINTMENT_PROJECTION).sort([('date', 1), ('time', 1)]).skip(offset)
+    if limit:
+        cursor = cursor.limit(limit)
+    meets = list(cursor)
+    # A short page already tells us the total; only a full (or overshot) page needs a count
+    last_page = (not limit or len(meets) < limit) and (meets or not offset)
+    total = offset + len(meets) if last_page else appointments.count_documents(query)
+    names = resolve_names(others, (meet.get(other_email_field) for meet in meets))
+    for meet in meets:
+        meet[name_field] = names.get(meet.get(other_email_field), UNKNOWN_NAME)
+    return {'completedMeets': meets, 'total': total, 'offset': offset, 'limit': limit}
@@ -0,0 +1,317 @@
+"""
+Request, database and outbound-call metrics in the Prometheus text format.
+
+init_app(app) installs request middleware and serves GET /metrics:
+
+    http_requests_total{method, endpoint, status}
+    http_request_duration_seconds{method, endpoint}       histogram
+    http_requests_in_flight
+    http_streams_open                                     streamed responses (SSE) still sending
+    mongo_command_duration_seconds{collection, command}   histogram (MongoCommandTimer)
+    mongo_command_failures_total{collection, command}
+    external_call_duration_seconds{service, operation}    histogram (timed())
+    external_call_failures_total{service, operation}
+
+`endpoint` is the URL rule ("/get_wallet", "/media/<path:key>"), never the raw
+path, so label cardinality stays bounded. Streamed responses (SSE) are timed
+until their headers are ready, not until the stream closes; from then on they
+count in http_streams_open instead of http_requests_in_flight, so long-lived
+/presence/stream clients do not read as stuck requests.
+
+Metrics live in the worker process: with several gunicorn workers each scrape
+sees one worker, and `process_start_time_seconds` tells the series apart
+across restarts. /metrics requires `Authorization: Bearer <METRICS_TOKEN>`;
+without a token it answers 403, unless METRICS_PUBLIC=true opens it (local
+runs, or a scraper on a private network).
+"""
+import bisect
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+from utils import eventLog
+
+REQUEST_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+EXTERNAL_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+SLOW_REQUEST_SECONDS = float(os.getenv('LOG_SLOW_REQUEST_MS', 1000)) / 1000.0
+REQUEST_LOG_SAMPLE = float(os.getenv('LOG_REQUEST_SAMPLE_RATE', 0.01))
+
+log = eventLog.get_logger('http')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        return [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}' for key, value in items]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        # Per-bucket counts; cumulated when rendered
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][slot] += 1
+            state[1] += value
+
+    def _samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+process_start = registry.gauge('process_start_time_seconds', 'Start time of the process since the epoch.')
+process_start.set(time.time())
+
+http_requests = registry.counter('http_requests_total', 'HTTP requests by route and status code.',
+                                 ('method', 'endpoint', 'status'))
+http_duration = registry.histogram('http_request_duration_seconds', 'Time to produce an HTTP response.',
+                                   ('method', 'endpoint'))
+http_in_flight = registry.gauge('http_requests_in_flight', 'HTTP requests being served.')
+http_in_flight.set(0)
+http_streams = registry.gauge('http_streams_open', 'Streamed responses (SSE) still being sent.')
+http_streams.set(0)
+
+mongo_duration = registry.histogram('mongo_command_duration_seconds', 'MongoDB command round trips.',
+                                    ('collection', 'command'), COMMAND_BUCKETS)
+mongo_failures = registry.counter('mongo_command_failures_total', 'MongoDB commands that returned an error.',
+                                  ('collection', 'command'))
+
+external_duration = registry.histogram('external_call_duration_seconds',
+                                       'Calls to Stripe, Twilio, Cloudinary and SMTP.',
+                                       ('service', 'operation'), EXTERNAL_BUCKETS)
+external_failures = registry.counter('external_call_failures_total', 'Outbound calls that raised.',
+                                     ('service', 'operation'))
+
+
+@contextmanager
+def timed(service, operation):
+    """Time an outbound call: `with metrics.timed('stripe', 'payment_intent'): ...`"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        external_failures.inc(service, operation)
+        raise
+    finally:
+        external_duration.observe(time.perf_counter() - started, service, operation)
+
+
+# ---- MongoDB ----
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    Times every command a MongoClient sends; pass it as
+    MongoClient(..., event_listeners=[MongoCommandTimer()]).
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _collection(event):
+        target = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            target = event.command.get('collection')
+        return target if isinstance(target, str) else '-'
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = self._collection(event)
+
+    def _finish(self, event):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), '-')
+        mongo_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        mongo_failures.inc(self._finish(event), event.command_name)
+
+
+# ---- Flask ----
+
+def _endpoint():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _start():
+    g.metrics_started = time.perf_counter()
+    g.metrics_in_flight = True
+    http_in_flight.inc()
+
+
+def _record(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = _endpoint()
+    http_requests.inc(request.method, endpoint, response.status_code)
+    http_duration.observe(elapsed, request.method, endpoint)
+    if response.is_streamed and g.pop('metrics_in_flight', None):
+        # The handler is done; the open connection is tracked until the server closes the stream
+        http_in_flight.dec()
+        http_streams.inc()
+        response.call_on_close(http_streams.dec)
+
+    level = eventLog.INFO
+    if response.status_code >= 500:
+        level = eventLog.ERROR
+    elif elapsed >= SLOW_REQUEST_SECONDS:
+        level = eventLog.WARNING
+    eventLog.event(log, 'request', level=level, sample=None if level > eventLog.INFO else REQUEST_LOG_SAMPLE,
+                   method=request.method, endpoint=endpoint, status=response.status_code,
+                   ms=round(elapsed * 1000.0, 2))
+    return response
+
+
+def _done(exc):
+    # Teardown runs for every request, including ones whose response failed
+    if g.pop('metrics_in_flight', None):
+        http_in_flight.dec()
+
+
+def _authorized():
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return None
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header, f'Bearer {token}')
+
+
+def metrics_view():
+    authorized = _authorized()
+    if authorized is None and os.getenv('METRICS_PUBLIC', 'false').lower() != 'true':
+        return Response('Set METRICS_TOKEN (or METRICS_PUBLIC=true) to enable /metrics\n', status=403,
+                        mimetype='text/plain')
+    if authorized is False:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """Install before init_app() of other after_request hooks so it times their work too."""
+    app.before_request(_start)
+    app.after_request(_record)
+    app.teardown_request(_done)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
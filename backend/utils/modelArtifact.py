@@ -0,0 +1,164 @@
+"""
+Single-file, memory-mappable model artifact.
+
+Layout: 8 byte magic, 8 byte little-endian header length, a JSON header
+(model meta, symptom/disease/knowledge tables and array descriptors), then
+every flat-model array at a 64 byte aligned offset. Workers open the file with
+a read-only mmap and wrap the arrays with np.frombuffer, so all gunicorn
+workers on a host share one physical copy through the page cache instead of
+each unpickling its own estimator. Like the flat export, the header meta
+records the source pickle (utils/flatForest.source_stamp) so a rebuilt pickle
+makes the artifact stale instead of silently shadowing it.
+
+Build once (needs scikit-learn or xgboost):
+    python -m utils.modelArtifact build ../models/ExtraTrees
+    python -m utils.modelArtifact build ../models/XGBoost
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import pickle
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from utils.diseaseIndex import DiseaseIndex, build_disease_index
+from utils.flatForest import FlatForest, check, flatten, source_stamp
+
+MAGIC = b'MHMODEL\x01'
+ALIGN = 64
+SUFFIX = '.artifact'
+
+
+def artifact_path(model_file):
+    model_file = Path(model_file)
+    return model_file.with_name(model_file.name + SUFFIX)
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class ModelArtifact:
+    """A loaded artifact: the FlatForest predictor plus the tables it was built with."""
+
+    def __init__(self, model, symptoms, diseases, knowledge, meta, buffer=None):
+        self.model = model
+        self.symptoms = symptoms
+        self.diseases = diseases
+        self.knowledge = knowledge
+        self.meta = meta
+        # Keeps the mmap alive for as long as the arrays view into it
+        self._buffer = buffer
+
+
+def write_artifact(path, flat, symptoms, diseases, knowledge):
+    """
+    :param flat: FlatForest to store
+    :param symptoms: feature column names, in model column order
+    :param diseases: class names, in predict_proba column order
+    :param knowledge: DiseaseIndex with descriptions/precautions/severity
+    """
+    descriptors = {}
+    offset = 0
+    blobs = []
+    for name, array in flat.arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = _aligned(offset)
+        descriptors[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        blobs.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({
+        'meta': flat.meta,
+        'tables': {
+            'symptoms': list(symptoms),
+            'diseases': list(diseases),
+            'knowledge': knowledge.to_dict(),
+        },
+        'arrays': descriptors,
+    }).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack('<Q', len(header)))
+        fp.write(header)
+        for blob_offset, array in blobs:
+            fp.seek(data_start + blob_offset)
+            fp.write(array.tobytes())
+    # Atomic swap: workers that still map the old file keep their inode
+    os.replace(tmp, path)
+    return path
+
+
+def load_artifact(path):
+    with open(path, 'rb') as fp:
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        buffer.close()
+        raise ValueError(f'{path} is not a model artifact')
+    (header_len,) = struct.unpack('<Q', buffer[len(MAGIC):len(MAGIC) + 8])
+    header_start = len(MAGIC) + 8
+    header = json.loads(buffer[header_start:header_start + header_len].decode('utf-8'))
+    data_start = _aligned(header_start + header_len)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        count = math.prod(spec['shape'])
+        arrays[name] = np.frombuffer(buffer, dtype=np.dtype(spec['dtype']), count=count,
+                                     offset=data_start + spec['offset']).reshape(spec['shape'])
+
+    tables = header['tables']
+    return ModelArtifact(
+        model=FlatForest(arrays, header['meta']),
+        symptoms=tables['symptoms'],
+        diseases=tables['diseases'],
+        knowledge=DiseaseIndex.from_dict(tables['knowledge']),
+        meta=header['meta'],
+        buffer=buffer,
+    )
+
+
+def main(argv=None):
+    from utils.modelRegistry import DISEASES, SYMPTOMS
+
+    parser = argparse.ArgumentParser(description='Build or inspect memory-mappable model artifacts')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build')
+    build.add_argument('model', help='pickled model, e.g. ../models/ExtraTrees')
+    build.add_argument('--out', help='output file (default: <model>.artifact)')
+    build.add_argument('--tolerance', type=float, default=1e-5)
+    inspect = sub.add_parser('inspect')
+    inspect.add_argument('artifact')
+    args = parser.parse_args(argv)
+
+    if args.command == 'inspect':
+        artifact = load_artifact(args.artifact)
+        print(json.dumps(dict(artifact.meta, symptoms=len(artifact.symptoms), diseases=len(artifact.diseases),
+                              knowledge=len(artifact.knowledge)), indent=2))
+        return 0
+
+    model_file = Path(args.model)
+    with open(model_file, 'rb') as fp:
+        model = pickle.load(fp)
+    flat = flatten(model)
+    error = check(model, flat)
+    if error > args.tolerance:
+        print(f'Flattened model differs from the original by {error:.3g} (> {args.tolerance})')
+        return 1
+    flat.meta['source'] = source_stamp(model_file)
+    knowledge = build_disease_index(model_file.parent)
+    out = write_artifact(Path(args.out) if args.out else artifact_path(model_file), flat, SYMPTOMS, DISEASES, knowledge)
+    print(f"Wrote {out} ({os.path.getsize(out) / 1e6:.2f} MB, {flat.meta['n_trees']} trees, max abs diff {error:.3g})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import json
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from utils import eventLog
+from utils.diseaseIndex import build_disease_index
+
+log = eventLog.get_logger('prediction')
+
+DISEASES = ['(vertigo) Paroymsal Positional Vertigo', 'AIDS', 'Acne', 'Alcoholic hepatitis', 'Allergy', 'Arthritis', 'Bronchial Asthma', 'Cervical spondylosis', 'Chicken pox', 'Chronic cholestasis', 'Common Cold', 'Dengue', 'Diabetes', 'Dimorphic hemmorhoids(piles)', 'Drug Reaction', 'Fungal infection', 'GERD', 'Gastroenteritis', 'Heart attack', 'Hepatitis B', 'Hepatitis C', 'Hepatitis D', 'Hepatitis E', 'Hypertension', 'Hyperthyroidism', 'Hypoglycemia', 'Hypothyroidism', 'Impetigo', 'Jaundice', 'Malaria', 'Migraine', 'Osteoarthristis', 'Paralysis (brain hemorrhage)', 'Peptic ulcer diseae', 'Pneumonia', 'Psoriasis', 'Tuberculosis', 'Typhoid', 'Urinary tract infection', 'Varicose veins', 'hepatitis A']
+
+SYMPTOMS = ['Disease', 'itching', 'skin_rash', 'nodal_skin_eruptions', 'continuous_sneezing', 'shivering', 'chills', 'joint_pain', 'stomach_pain', 'acidity', 'ulcers_on_tongue', 'muscle_wasting', 'vomiting', 'burning_micturition', 'fatigue', 'weight_gain', 'anxiety', 'cold_hands_and_feets', 'mood_swings', 'weight_loss', 'restlessness', 'lethargy', 'patches_in_throat', 'irregular_sugar_level', 'cough', 'high_fever', 'sunken_eyes', 'breathlessness', 'sweating', 'dehydration', 'indigestion', 'headache', 'yellowish_skin', 'dark_urine', 'nausea', 'loss_of_appetite', 'pain_behind_the_eyes', 'back_pain', 'constipation', 'abdominal_pain', 'diarrhoea', 'mild_fever', 'yellow_urine', 'yellowing_of_eyes', 'acute_liver_failure', 'fluid_overload', 'swelling_of_stomach', 'swelled_lymph_nodes', 'malaise', 'blurred_and_distorted_vision', 'phlegm', 'throat_irritation', 'redness_of_eyes', 'sinus_pressure', 'runny_nose', 'congestion', 'chest_pain', 'weakness_in_limbs', 'fast_heart_rate', 'pain_during_bowel_movements', 'pain_in_anal_region', 'bloody_stool', 'irritation_in_anus', 'neck_pain', 'dizziness', 'cramps', 'bruising', 'obesity', 'swollen_legs', 'swollen_blood_vessels', 'puffy_face_and_eyes', 'enlarged_thyroid', 'brittle_nails', 'swollen_extremeties', 'excessive_hunger', 'extra_marital_contacts', 'drying_and_tingling_lips', 'slurred_speech', 'knee_pain', 'hip_joint_pain', 'muscle_weakness', 'stiff_neck', 'swelling_joints', 'movement_stiffness', 'spinning_movements', 'loss_of_balance', 'unsteadiness', 'weakness_of_one_body_side', 'loss_of_smell', 'bladder_discomfort', 'continuous_feel_of_urine', 'passage_of_gases', 'internal_itching', 'toxic_look_(typhos)', 'depression', 'irritability', 'muscle_pain', 'altered_sensorium', 'red_spots_over_body', 'belly_pain', 'abnormal_menstruation', 'watering_from_eyes', 'increased_appetite', 'polyuria', 'family_history', 'mucoid_sputum', 'rusty_sputum', 'lack_of_concentration', 'visual_disturbances', 'receiving_blood_transfusion', 'receiving_unsterile_injections', 'coma', 'stomach_bleeding', 'distention_of_abdomen', 'history_of_alcohol_consumption', 'blood_in_sputum', 'prominent_veins_on_calf', 'palpitations', 'painful_walking', 'pus_filled_pimples', 'blackheads', 'scurring', 'skin_peeling', 'silver_like_dusting', 'small_dents_in_nails', 'inflammatory_nails', 'blister', 'red_sore_around_nose', 'yellow_crust_ooze', 'prognosis', 'skin rash', 'mood swings', 'weight loss', 'fast heart rate', 'excessive hunger', 'muscle weakness', 'abnormal menstruation', 'muscle wasting', 'patches in throat', 'high fever', 'extra marital contacts', 'yellowish skin', 'loss of appetite', 'abdominal pain', 'yellowing of eyes', 'chest pain', 'loss of balance', 'lack of concentration', 'blurred and distorted vision', 'drying and tingling lips', 'slurred speech', 'stiff neck', 'swelling joints', 'painful walking', 'dark urine', 'yellow urine', 'receiving blood transfusion', 'receiving unsterile injections', 'visual disturbances', 'burning micturition', 'bladder discomfort', 'foul smell of urine', 'continuous feel of urine', 'irregular sugar level', 'increased appetite', 'joint pain', 'skin peeling', 'small dents in nails', 'inflammatory nails', 'swelling of stomach', 'distention of abdomen', 'history of alcohol consumption', 'fluid overload', 'pain during bowel movements', 'pain in anal region', 'bloody stool', 'irritation in anus', 'acute liver failure', 'stomach bleeding', 'back pain', 'weakness in limbs', 'neck pain', 'mucoid sputum', 'mild fever', 'muscle pain', 'family history', 'continuous sneezing', 'watering from eyes', 'rusty sputum', 'weight gain', 'puffy face and eyes', 'enlarged thyroid', 'brittle nails', 'swollen extremeties', 'swollen legs', 'prominent veins on calf', 'stomach pain', 'spinning movements', 'sunken eyes', 'silver like dusting', 'swelled lymph nodes', 'blood in sputum', 'swollen blood vessels', 'toxic look (typhos)', 'belly pain', 'throat irritation', 'redness of eyes', 'sinus pressure', 'runny nose', 'loss of smell', 'passage of gases', 'cold hands and feets', 'weakness of one body side', 'altered sensorium', 'nodal skin eruptions', 'red sore around nose', 'yellow crust ooze', 'ulcers on tongue', 'spotting  urination', 'pain behind the eyes', 'red spots over body', 'internal itching']
+
+# Everything predict() needs, loaded together so a reload swaps it in one assignment
+# `watch`: every file that decides what is served; `version` is their combined stat
+ModelBundle = namedtuple('ModelBundle', ['model', 'knowledge', 'diseases', 'symptoms', 'symptom_index', 'version', 'path', 'loaded_at', 'watch'])
+
+
+class ModelUnavailable(Exception):
+    """Raised when the prediction model cannot be located or loaded."""
+
+    def __init__(self, message, searched_paths=None):
+        super().__init__(message)
+        self.searched_paths = searched_paths or []
+
+
+def candidate_model_dirs():
+    """
+    Directories that may hold the model files, in lookup order.
+    For local development the models live in ../models, for Render/Docker
+    they may be copied next to the backend or to /app/models.
+    """
+    current_file = Path(__file__).resolve()
+    backend_dir = current_file.parent.parent
+    paths = []
+    if os.getenv('MODELS_DIR'):
+        paths.append(Path(os.getenv('MODELS_DIR')))
+    paths += [
+        backend_dir.parent / 'models',  # root/models
+        backend_dir / 'models',  # backend/models
+        Path('/app/models'),  # Docker/Render absolute path
+    ]
+    return paths
+
+
+def find_models_dir(model_name):
+    searched = candidate_model_dirs()
+    for path in searched:
+        # The pickled estimator or one of its exports (utils/modelArtifact.py, utils/flatForest.py)
+        if any((path / f'{model_name}{suffix}').exists() for suffix in ('', '.artifact', '.flat')):
+            return path
+    raise ModelUnavailable('Disease prediction model not found', [str(p) for p in searched])
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def _watch_version(paths):
+    versions = []
+    for path in paths:
+        try:
+            versions.append(_file_version(path))
+        except FileNotFoundError:
+            versions.append('-')
+    return '|'.join(versions)
+
+
+def _pick_format(artifact_file, flat_dir, model_file):
+    """auto: the first export that exists and was built from the current pickle, else the pickle."""
+    from utils.flatForest import META_FILE, is_current
+    from utils.modelArtifact import load_artifact
+
+    exports = (
+        ('artifact', artifact_file, lambda: load_artifact(artifact_file).meta),
+        ('flat', flat_dir / META_FILE, lambda: json.loads((flat_dir / META_FILE).read_text())),
+    )
+    for fmt, path, read_meta in exports:
+        if not path.exists():
+            continue
+        if is_current(read_meta(), model_file):
+            return fmt
+        eventLog.event(log, 'stale_export', level=eventLog.WARNING, path=str(path), source=str(model_file))
+    return 'pickle'
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the disease prediction model and its lookup tables.
+
+    The bundle is loaded once (at worker start via warm_in_background() or on
+    first use behind a lock) and handed out read-only to every request. The
+    model files (the pickle and its exports) are re-stat'ed at most every
+    `check_interval` seconds and, when any of them changes, a new bundle is
+    loaded in the background and swapped in atomically; requests keep using
+    the previous bundle until then. An export built from another version of
+    the pickle is never served: auto falls back to the next format, an
+    explicit PREDICTION_MODEL_FORMAT fails to load.
+    """
+
+    def __init__(self, model_name=None, check_interval=None, model_format=None):
+        self.model_name = model_name or os.getenv('PREDICTION_MODEL', 'ExtraTrees')
+        # auto: prefer the mmap artifact, then the flat array export, else unpickle the estimator
+        self.model_format = model_format or os.getenv('PREDICTION_MODEL_FORMAT', 'auto')
+        self.check_interval = float(check_interval if check_interval is not None else os.getenv('MODEL_RELOAD_INTERVAL', 30))
+        self._bundle = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._last_check = 0.0
+        self._last_error = None
+        self._searched_paths = []
+        self._reloads = 0
+
+    def get(self):
+        bundle = self._bundle
+        if bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._bundle = self._load()
+                bundle = self._bundle
+        else:
+            self._maybe_reload(bundle)
+        return bundle
+
+    def reload(self):
+        """Load the model from disk again and swap it in. Returns the new bundle."""
+        bundle = self._load()
+        with self._lock:
+            self._bundle = bundle
+            self._reloads += 1
+        eventLog.event(log, 'model_loaded', path=str(bundle.path), version=bundle.version)
+        return bundle
+
+    def warm_in_background(self):
+        """Load and warm the model without blocking the caller (e.g. at worker start)."""
+        def _warm():
+            try:
+                self.get()
+            except ModelUnavailable as e:
+                eventLog.event(log, 'model_unavailable', level=eventLog.ERROR, error=str(e))
+        threading.Thread(target=_warm, name='model-warmup', daemon=True).start()
+
+    def health(self):
+        bundle = self._bundle
+        if bundle is not None:
+            status = 'ready'
+        elif self._last_error:
+            status = 'unavailable'
+        else:
+            status = 'loading' if self._lock.locked() else 'not_loaded'
+        return {
+            'status': status,
+            'model': self.model_name,
+            'format': type(bundle.model).__name__ if bundle else None,
+            'version': bundle.version if bundle else None,
+            'path': str(bundle.path) if bundle else None,
+            'loaded_at': bundle.loaded_at if bundle else None,
+            'reloads': self._reloads,
+            'last_error': self._last_error,
+            'searched_paths': self._searched_paths if bundle is None else [],
+        }
+
+    def _maybe_reload(self, bundle):
+        now = time.monotonic()
+        if self.check_interval <= 0 or now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            if _watch_version(bundle.watch) == bundle.version:
+                return
+        except OSError:
+            # File is being replaced; keep serving the current bundle
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_reload, name='model-reload', daemon=True).start()
+
+    def _background_reload(self):
+        try:
+            self.reload()
+        except ModelUnavailable as e:
+            eventLog.event(log, 'model_reload_failed', level=eventLog.ERROR, error=str(e))
+        finally:
+            self._reloading = False
+
+    def _load(self):
+        try:
+            models_dir = find_models_dir(self.model_name)
+        except ModelUnavailable as e:
+            self._last_error = str(e)
+            self._searched_paths = e.searched_paths
+            raise
+
+        model_file = models_dir / self.model_name
+        symptoms, diseases = SYMPTOMS, DISEASES
+        try:
+            import numpy as np
+            from utils.flatForest import FlatForest, META_FILE, flat_path, is_current
+            from utils.modelArtifact import artifact_path, load_artifact
+            from utils.prediction import build_symptom_index
+
+            artifact_file = artifact_path(model_file)
+            flat_dir = flat_path(model_file)
+            watch = (model_file, artifact_file, flat_dir / META_FILE)
+            # Stat before reading, so a file replaced mid-load is picked up by the next check
+            version = _watch_version(watch)
+            fmt = self.model_format
+            # auto only picks exports that match the pickle; an explicit format is checked here
+            verify = fmt != 'auto'
+            if fmt == 'auto':
+                fmt = _pick_format(artifact_file, flat_dir, model_file)
+
+            if fmt == 'artifact':
+                # Weights and tables live in one read-only mmap shared by every worker
+                artifact = load_artifact(artifact_file)
+                if verify and not is_current(artifact.meta, model_file):
+                    raise ValueError(f'{artifact_file.name} was built from another version of {model_file.name}')
+                served = artifact_file
+                model = artifact.model
+                symptoms, diseases, knowledge = artifact.symptoms, artifact.diseases, artifact.knowledge
+            else:
+                if fmt == 'flat':
+                    model = FlatForest.load(flat_dir, mmap=os.getenv('MODEL_MMAP', 'true').lower() == 'true')
+                    if verify and not is_current(model.meta, model_file):
+                        raise ValueError(f'{flat_dir.name} was exported from another version of {model_file.name}')
+                    served = flat_dir / META_FILE
+                else:
+                    served = model_file
+                    with open(model_file, 'rb') as fp:
+                        model = pickle.load(fp)
+                knowledge = build_disease_index(models_dir)
+
+            # Warm up: the first predict_proba call on a fresh estimator is
+            # noticeably slower (lazy validation, allocator warm-up)
+            model.predict_proba(np.zeros((1, len(symptoms))))
+        except ImportError as e:
+            self._last_error = f'Required libraries not available: {e}'
+            raise ModelUnavailable(self._last_error) from e
+        except Exception as e:
+            self._last_error = f'Failed to load prediction model: {e}'
+            raise ModelUnavailable(self._last_error) from e
+
+        self._last_error = None
+        self._last_check = time.monotonic()
+        return ModelBundle(
+            model=model,
+            knowledge=knowledge,
+            diseases=diseases,
+            symptoms=symptoms,
+            symptom_index=build_symptom_index(symptoms),
+            version=version,
+            path=served,
+            loaded_at=time.time(),
+            watch=watch,
+        )
+
+
+model_registry = ModelRegistry()
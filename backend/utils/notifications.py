@@ -0,0 +1,453 @@
+"""
+Outbound e-mail and WhatsApp notifications.
+
+Request handlers only enqueue: every notification is written to a local
+SQLite queue (so it survives a worker restart) and a small, fixed pool of
+background threads delivers it. Workers claim jobs in batches per channel,
+send a whole e-mail batch over one reused SMTP connection, and retry failures
+with exponential backoff until NOTIFY_MAX_ATTEMPTS, after which the job is
+kept as "dead" for inspection. create_app() starts the workers, so jobs left
+in the queue by a previous process are delivered without waiting for a new
+enqueue; a worker that hits an unexpected error logs it and backs off instead
+of dying.
+
+NOTIFY_TRANSPORT=outbox swaps SMTP and Twilio for a stand-in that appends every
+message to a JSON-lines file (NOTIFY_OUTBOX_PATH), for local runs and tests.
+"""
+import atexit
+import base64
+import json
+import os
+import random
+import smtplib
+import sqlite3
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+
+from utils import eventLog
+from utils.metrics import timed
+
+EMAIL = 'email'
+WHATSAPP = 'whatsapp'
+
+log = eventLog.get_logger('notifications')
+
+
+class PermanentError(Exception):
+    """Delivery can never succeed (e.g. channel not configured); do not retry."""
+
+
+class PersistentQueue:
+    """
+    Job queue in a SQLite file, safe to share between threads and gunicorn workers.
+
+    Claimed jobs are leased for `lease` seconds; jobs whose worker died are
+    picked up again once the lease runs out.
+    """
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        # journal_mode cannot change inside a transaction (fails once another worker has the file open)
+        self._connect().db.execute('PRAGMA journal_mode=WAL')
+        with self._connect() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL)''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, channel, available_at)')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(db)
+
+    def put(self, channel, payload):
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT INTO jobs (channel, payload, available_at, created_at) VALUES (?, ?, ?, ?)',
+                       (channel, json.dumps(payload), now, now))
+
+    def claim(self, channel, limit):
+        """:return: list of (id, payload, attempts) now leased to the caller"""
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute(
+                '''SELECT id, payload, attempts FROM jobs
+                   WHERE channel = ? AND status IN ('pending', 'inflight') AND available_at <= ?
+                   ORDER BY available_at LIMIT ?''', (channel, now, limit)).fetchall()
+            if rows:
+                db.execute(f"UPDATE jobs SET status = 'inflight', available_at = ? "
+                           f"WHERE id IN ({','.join('?' * len(rows))})", (now + self.lease, *[r[0] for r in rows]))
+        return [(job_id, json.loads(payload), attempts) for job_id, payload, attempts in rows]
+
+    def ack(self, job_ids):
+        if job_ids:
+            with self._connect() as db:
+                db.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", tuple(job_ids))
+
+    def retry(self, job_id, error, delay):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'pending', attempts = attempts + 1, available_at = ?, last_error = ? "
+                       "WHERE id = ?", (time.time() + delay, error, job_id))
+
+    def bury(self, job_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                       (error, job_id))
+
+    def counts(self):
+        with self._connect() as db:
+            rows = db.execute('SELECT channel, status, COUNT(*) FROM jobs GROUP BY channel, status').fetchall()
+        counts = {}
+        for channel, status, count in rows:
+            counts.setdefault(channel, {})[status] = count
+        return counts
+
+
+class _Transaction:
+    """`with` block running in one IMMEDIATE transaction (serialises claims across processes)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+# ---- senders ----
+
+def build_email(payload, default_sender=None):
+    message = EmailMessage()
+    message['Subject'] = payload.get('subject', '')
+    message['From'] = payload.get('sender') or default_sender
+    message['To'] = ', '.join(payload['recipients'])
+    message.set_content(payload.get('body') or '')
+    if payload.get('html'):
+        message.add_alternative(payload['html'], subtype='html')
+    for attachment in payload.get('attachments', []):
+        maintype, _, subtype = attachment['content_type'].partition('/')
+        message.add_attachment(_attachment_data(attachment), maintype=maintype, subtype=subtype or 'octet-stream',
+                               filename=attachment['filename'])
+    return message
+
+
+def _attachment_data(attachment):
+    """Inline (base64 `data`) or a file on this host (`path`), e.g. a spooled prescription."""
+    if 'path' in attachment:
+        with open(attachment['path'], 'rb') as fp:
+            return fp.read()
+    return base64.b64decode(attachment['data'])
+
+
+def release_attachments(payload):
+    """Delete attachment files handed over with `release: true` once their job is finished."""
+    for attachment in payload.get('attachments', []):
+        if attachment.get('release'):
+            try:
+                os.remove(attachment['path'])
+            except FileNotFoundError:
+                pass
+
+
+class SMTPSender:
+    """Sends e-mail batches over one SMTP connection per worker thread, reconnecting only when it drops."""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, default_sender=None, idle_timeout=60):
+        self.host = host
+        self.port = int(port or 587)
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.default_sender = default_sender or username
+        self.idle_timeout = idle_timeout
+        self._local = threading.local()
+        self.connections_opened = 0
+
+    def _connection(self):
+        smtp = getattr(self._local, 'smtp', None)
+        if smtp is not None and time.monotonic() - self._local.used_at > self.idle_timeout:
+            # Servers drop idle sessions; check before reusing one that sat around
+            try:
+                smtp.noop()
+            except smtplib.SMTPException:
+                smtp = None
+        if smtp is None:
+            with timed('smtp', 'connect'):
+                smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+                if self.use_tls:
+                    smtp.starttls()
+                if self.username and self.password:
+                    smtp.login(self.username, self.password)
+            self._local.smtp = smtp
+            self.connections_opened += 1
+        self._local.used_at = time.monotonic()
+        return smtp
+
+    def _drop(self):
+        smtp = getattr(self._local, 'smtp', None)
+        self._local.smtp = None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+    def send_batch(self, payloads):
+        """:return: one None (sent) or exception per payload"""
+        results = []
+        for payload in payloads:
+            try:
+                smtp = self._connection()
+                with timed('smtp', 'send'):
+                    smtp.send_message(build_email(payload, self.default_sender))
+                results.append(None)
+            except smtplib.SMTPRecipientsRefused as e:
+                results.append(PermanentError(str(e)))
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                # Connection is gone: fail this one, reconnect for the next
+                self._drop()
+                results.append(e)
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class TwilioSender:
+    """:param client: a Twilio Client, or a zero-argument callable returning one (resolved on first send)"""
+
+    def __init__(self, client, from_):
+        self.client = client
+        self.from_ = from_
+
+    def send_batch(self, payloads):
+        if callable(self.client):
+            self.client = self.client()
+        results = []
+        for payload in payloads:
+            if self.client is None:
+                results.append(PermanentError('Twilio WhatsApp is not configured'))
+                continue
+            try:
+                with timed('twilio', 'message'):
+                    self.client.messages.create(from_=self.from_, to=payload['to'], body=payload['body'])
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class OutboxSender:
+    """Local stand-in for SMTP/Twilio: appends each message to a JSON-lines file."""
+
+    def __init__(self, path, channel):
+        self.path = path
+        self.channel = channel
+        self._lock = threading.Lock()
+
+    def send_batch(self, payloads):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as fp:
+            for payload in payloads:
+                fp.write(json.dumps({'channel': self.channel, 'sent_at': time.time(), 'message': payload}) + '\n')
+        return [None] * len(payloads)
+
+
+# ---- service ----
+
+class NotificationService:
+    """
+    :param senders: channel -> object with send_batch(payloads) -> [None | Exception]
+    :param on_dead: optional callable(channel, payload, error) run when a job is given up on
+    """
+
+    def __init__(self, queue, senders, workers=2, batch_size=20, max_attempts=5, backoff=2.0, max_backoff=600.0,
+                 poll_interval=1.0, on_dead=None):
+        self.queue = queue
+        self.senders = senders
+        self.on_dead = on_dead
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {channel: {'enqueued': 0, 'sent': 0, 'failed_attempts': 0, 'dead': 0, 'batches': 0,
+                                   'send_seconds': 0.0} for channel in senders}
+
+    @classmethod
+    def from_env(cls, mail_config, twilio_client=None, twilio_from=None):
+        transport = os.getenv('NOTIFY_TRANSPORT', 'live').lower()
+        if transport == 'outbox':
+            outbox = os.getenv('NOTIFY_OUTBOX_PATH', os.path.join(tempfile.gettempdir(), 'telmedsphere-outbox.jsonl'))
+            senders = {EMAIL: OutboxSender(outbox, EMAIL), WHATSAPP: OutboxSender(outbox, WHATSAPP)}
+        else:
+            senders = {
+                EMAIL: SMTPSender(mail_config.get('MAIL_SERVER'), mail_config.get('MAIL_PORT'),
+                                  mail_config.get('MAIL_USERNAME'), mail_config.get('MAIL_PASSWORD'),
+                                  mail_config.get('MAIL_USE_TLS', True), mail_config.get('MAIL_DEFAULT_SENDER')),
+                WHATSAPP: TwilioSender(twilio_client, twilio_from),
+            }
+        path = os.getenv('NOTIFY_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'telmedsphere-notifications.db'))
+        return cls(
+            PersistentQueue(path),
+            senders,
+            workers=int(os.getenv('NOTIFY_WORKERS', 2)),
+            batch_size=int(os.getenv('NOTIFY_BATCH_SIZE', 20)),
+            max_attempts=int(os.getenv('NOTIFY_MAX_ATTEMPTS', 5)),
+        )
+
+    # ---- producers ----
+
+    def enqueue(self, channel, payload):
+        if channel not in self.senders:
+            raise ValueError(f"Unknown notification channel: {channel}")
+        self.queue.put(channel, payload)
+        self._count(channel, 'enqueued')
+        self.start()
+        self._wake.set()
+
+    def whatsapp(self, to, body):
+        self.enqueue(WHATSAPP, {'to': to, 'body': body})
+
+    def email(self, message):
+        """Queue a flask_mail.Message (rendered in the request, delivered in the background)."""
+        self.enqueue(EMAIL, {
+            'subject': message.subject,
+            'sender': message.sender if isinstance(message.sender, str) else None,
+            'recipients': list(message.recipients),
+            'body': message.body,
+            'html': message.html,
+            'attachments': [{'filename': a.filename, 'content_type': a.content_type,
+                             'data': base64.b64encode(a.data).decode('ascii')} for a in message.attachments],
+        })
+
+    # ---- workers ----
+
+    def start(self):
+        """Start the delivery threads (idempotent); call it in the process that serves requests."""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'notify-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                worked = False
+                for channel in self.senders:
+                    worked = self.process(channel) or worked
+                failures = 0
+            except Exception:
+                # e.g. the queue file is locked or the disk is full: keep the thread alive.
+                # Claimed jobs stay leased and are picked up again when the lease expires.
+                delay = self._delay(failures)
+                failures += 1
+                eventLog.event(log, 'notification_worker_error', level=eventLog.ERROR, exc_info=True,
+                               failures=failures, retry_in=round(delay, 3))
+                self._stop.wait(delay)
+                continue
+            if not worked:
+                # Also picks up jobs other workers queued or whose backoff expired
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def process(self, channel):
+        """Claim and deliver one batch; files of `release` attachments are deleted once their job is sent or buried.
+
+        :return: number of jobs handled
+        """
+        jobs = self.queue.claim(channel, self.batch_size)
+        if not jobs:
+            return 0
+        started = time.perf_counter()
+        try:
+            results = self.senders[channel].send_batch([payload for _, payload, _ in jobs])
+        except Exception as e:
+            results = [e] * len(jobs)
+        elapsed = time.perf_counter() - started
+
+        sent, finished = [], []
+        for (job_id, payload, attempts), error in zip(jobs, results):
+            if error is None:
+                sent.append(job_id)
+                finished.append(payload)
+            elif isinstance(error, PermanentError) or attempts + 1 >= self.max_attempts:
+                self.queue.bury(job_id, str(error))
+                self._count(channel, 'dead')
+                eventLog.event(log, 'notification_dead', level=eventLog.ERROR, job_id=job_id, channel=channel,
+                               error=str(error))
+                release_attachments(payload)
+                if self.on_dead is not None:
+                    self.on_dead(channel, payload, error)
+            else:
+                self.queue.retry(job_id, str(error), self._delay(attempts))
+                self._count(channel, 'failed_attempts')
+        self.queue.ack(sent)
+        for payload in finished:
+            release_attachments(payload)
+        with self._metrics_lock:
+            metrics = self._metrics[channel]
+            metrics['sent'] += len(sent)
+            metrics['batches'] += 1
+            metrics['send_seconds'] += elapsed
+        return len(jobs)
+
+    def _delay(self, attempts):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempts))
+        return delay * random.uniform(0.5, 1.0)  # jitter so retries do not arrive in lockstep
+
+    def drain(self, timeout=10.0):
+        """Deliver everything that is ready now (tests and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not any(self.process(channel) for channel in self.senders):
+                return True
+        return False
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _count(self, channel, key):
+        with self._metrics_lock:
+            self._metrics[channel][key] += 1
+
+    def stats(self):
+        with self._metrics_lock:
+            metrics = {channel: dict(values) for channel, values in self._metrics.items()}
+        for channel, values in metrics.items():
+            values['avg_batch_ms'] = round(values.pop('send_seconds') * 1000.0 / values['batches'], 3) \
+                if values['batches'] else 0.0
+        smtp = self.senders.get(EMAIL)
+        return {
+            'workers': len(self._threads),
+            'channels': metrics,
+            'queue': self.queue.counts(),
+            'smtp_connections_opened': getattr(smtp, 'connections_opened', None),
+        }
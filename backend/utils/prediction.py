@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+
+from utils import eventLog
+from utils.inferenceBatcher import InferenceBatcher
+from utils.ttlCache import TTLCache
+
+# Below this top-class probability the symptoms don't match any known pattern
+MIN_PROBABILITY = 0.1
+TOP_K = 3
+
+log = eventLog.get_logger('prediction')
+
+
+class PredictionError(Exception):
+    """A request-level prediction failure that maps to an HTTP status code."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def build_symptom_index(symptoms):
+    """Map every symptom name to its feature column (first occurrence wins, like list.index)."""
+    index = {}
+    for column, symptom in enumerate(symptoms):
+        index.setdefault(symptom, column)
+    return index
+
+
+def symptom_columns(symptom_index, data):
+    """
+    Resolve user-supplied symptom names to feature columns. Repeated symptoms
+    count once, as in the model service's parse_symptoms (models/app.py), so
+    both accept and reject the same lists.
+
+    :param symptom_index: symptom -> column dict from the model bundle
+    :param data: list of symptom names as sent by the client
+    :return: (sorted distinct columns, number of matched symptoms)
+    """
+    if not data:
+        raise PredictionError('No symptoms provided')
+    if len(data) < 2:
+        raise PredictionError('At least 2 symptoms are required for accurate prediction')
+
+    columns = set()
+    for symptom in data:
+        if not isinstance(symptom, str):
+            continue
+        # Normalize symptom name (handle both formats)
+        column = symptom_index.get(symptom.replace(' ', '_').lower())
+        if column is None:
+            column = symptom_index.get(symptom)
+        if column is not None:
+            columns.add(column)
+        else:
+            # Sampled: shows vocabulary gaps without a log line per request
+            eventLog.event(log, 'unknown_symptom', sample=eventLog.SAMPLE_RATE, symptom=symptom[:64])
+
+    if len(columns) < 2:
+        raise PredictionError('Not enough recognized symptoms. Please provide more symptoms.')
+    return sorted(columns), len(columns)
+
+
+def encode_rows(n_features, rows):
+    """Encode lists of feature columns into one dense 0/1 matrix in a single scatter."""
+    X = np.zeros((len(rows), n_features), dtype=np.float32)
+    row_ids = [r for r, columns in enumerate(rows) for _ in columns]
+    col_ids = [c for columns in rows for c in columns]
+    X[row_ids, col_ids] = 1
+    return X
+
+
+def build_response(bundle, proba_row):
+    """Turn one row of predict_proba output into the top-3 response list."""
+    if max(proba_row) < MIN_PROBABILITY:
+        raise PredictionError('The symptom combination does not match known disease patterns. Please provide more specific symptoms.')
+
+    top_idx = np.argsort(proba_row)[-TOP_K:][::-1]
+    response = []
+    for i in top_idx:
+        disease = bundle.diseases[i]
+        info = bundle.knowledge.get(disease)
+        response.append({
+            'disease': disease,
+            'probability': float(proba_row[i]),
+            'description': info.description,
+            'precautions': list(info.precautions),
+            'severity': info.severity
+        })
+    return response
+
+
+def _score_batch(X, bundle):
+    # The bundle the rows were encoded with, not whatever is current when the batch runs
+    return bundle.model.predict_proba(X)
+
+
+# Concurrent single-row /predict calls are coalesced into one predict_proba call
+inference_batcher = InferenceBatcher(_score_batch) if os.getenv('INFERENCE_BATCHING', 'true').lower() == 'true' else None
+
+
+def predict_row(bundle, columns):
+    """Score one symptom row, through the micro-batching scheduler when enabled."""
+    X = encode_rows(len(bundle.symptoms), [columns])
+    if inference_batcher is None:
+        return bundle.model.predict_proba(X)[0]
+    return inference_batcher.predict(X[0], bundle)
+
+
+class PredictionCache:
+    """
+    Assembled /predict responses keyed by model version and an order-independent
+    bitmask of the matched symptom columns. The model is deterministic, so a
+    repeat symptom combination skips both inference and response building.
+    Entries from an older model version are dropped as soon as a new one is seen.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._version = None
+
+    @staticmethod
+    def key(columns):
+        mask = 0
+        for column in columns:
+            mask |= 1 << column
+        return mask
+
+    def get(self, bundle, columns):
+        if bundle.version != self._version:
+            self._cache.clear()
+            self._version = bundle.version
+        return self._cache.get(self.key(columns))
+
+    def set(self, bundle, columns, result):
+        if bundle.version == self._version:
+            self._cache.set(self.key(columns), result)
+
+    def stats(self):
+        return dict(self._cache.stats(), model_version=self._version)
+
+
+prediction_cache = PredictionCache(
+    maxsize=int(os.getenv('PREDICTION_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('PREDICTION_CACHE_TTL', 3600)),
+)
+
+
+def cached_response(bundle, columns):
+    """Return the top-3 response for a symptom row (cached). Raises PredictionError."""
+    result = prediction_cache.get(bundle, columns)
+    if result is None:
+        try:
+            result = build_response(bundle, predict_row(bundle, columns))
+        except PredictionError as e:
+            result = e
+        prediction_cache.set(bundle, columns, result)
+    if isinstance(result, PredictionError):
+        raise result
+    return result
@@ -0,0 +1,119 @@
+"""
+Prescription uploads, stored once and delivered from a durable queue.
+
+The incoming file is streamed once, in chunks, into its own spool file
+(PRESCRIPTION_SPOOL_DIR/<unique name>) and never held whole in the request.
+Before the request returns, a job referencing that file and everything
+needed to deliver it is written to a SQLite queue (PRESCRIPTION_QUEUE_PATH,
+the same PersistentQueue notifications use), so an accepted prescription
+survives a worker restart.
+
+Background workers then upload the file, link it on the appointment and only
+then queue the WhatsApp message and an e-mail whose attachment points at the
+same spool file; the e-mail queue deletes it once the mail is sent or given
+up on. Failed attempts are retried with backoff; after
+PRESCRIPTION_MAX_ATTEMPTS the job is kept as "dead", the spool file is
+deleted and the appointment's prescription_status becomes "failed".
+"""
+import os
+import tempfile
+import uuid
+
+from utils import eventLog
+from utils.notifications import NotificationService, PersistentQueue
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_DIR = os.getenv('PRESCRIPTION_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'telmedsphere-prescriptions'))
+PRESCRIPTION = 'prescription'
+
+log = eventLog.get_logger('prescriptions')
+
+
+class PrescriptionUpload:
+    def __init__(self, name, path, size, content_type):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.content_type = content_type
+
+    def discard(self):
+        """Delete the spool file of an upload that will not be queued."""
+        release(self.path)
+
+
+def receive(file_storage, spool_dir=None):
+    """Stream an uploaded werkzeug FileStorage into a new spool file."""
+    spool_dir = spool_dir or SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    name = f"prescription-{uuid.uuid4().hex}.pdf"
+    path = os.path.join(spool_dir, name)
+    size = 0
+    try:
+        with open(path + '.part', 'wb') as fp:
+            for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                fp.write(chunk)
+                size += len(chunk)
+            fp.flush()
+            os.fsync(fp.fileno())
+        # Complete files only: a crash mid-copy leaves a .part, never a truncated prescription
+        os.replace(path + '.part', path)
+    except BaseException:
+        release(path + '.part')
+        raise
+    return PrescriptionUpload(name=name, path=path, size=size, content_type=file_storage.mimetype or 'application/pdf')
+
+
+def release(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def job(upload, **fields):
+    """Queue payload for `upload`: a reference to its spool file plus `fields` for the delivery step."""
+    return dict(fields, name=upload.name, path=upload.path, size=upload.size, content_type=upload.content_type)
+
+
+def read(job):
+    with open(job['path'], 'rb') as fp:
+        return fp.read()
+
+
+class PrescriptionSender:
+    """Adapts deliver(payload) to the send_batch() interface NotificationService drives."""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def send_batch(self, payloads):
+        results = []
+        for payload in payloads:
+            try:
+                self.deliver(payload)
+                results.append(None)
+            except Exception as e:
+                eventLog.event(log, 'prescription_failed', level=eventLog.WARNING, file=payload['name'],
+                               error=str(e))
+                results.append(e)
+        return results
+
+
+def create_queue(deliver, on_failed):
+    """
+    :param deliver: callable(payload); must be safe to repeat, it runs again after a failure
+    :param on_failed: callable(payload, error) once the job is given up on
+    """
+    def given_up(channel, payload, error):
+        release(payload['path'])
+        on_failed(payload, error)
+
+    path = os.getenv('PRESCRIPTION_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'telmedsphere-prescriptions.db'))
+    return NotificationService(
+        PersistentQueue(path),
+        {PRESCRIPTION: PrescriptionSender(deliver)},
+        workers=int(os.getenv('PRESCRIPTION_UPLOAD_WORKERS', 2)),
+        batch_size=1,
+        max_attempts=int(os.getenv('PRESCRIPTION_MAX_ATTEMPTS', 5)),
+        on_dead=given_up,
+    )
@@ -0,0 +1,369 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from pymongo import UpdateOne
+
+from utils import eventLog
+
+# Live doctor state kept out of the request hot path
+PRESENCE_FIELDS = ('status', 'meet', 'currentlyInMeet')
+
+# Gunicorn workers and threads per worker, as passed by start.sh
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+
+log = eventLog.get_logger('presence')
+
+
+class InMemoryPresenceStore:
+    """
+    Per-process presence store. Entries are trusted for `ttl` seconds after a
+    local write; after that callers fall back to the (write-behind) Mongo copy,
+    which also picks up changes made by other gunicorn workers.
+    """
+
+    shared = False
+
+    def __init__(self, ttl=None):
+        self.ttl = float(ttl if ttl is not None else os.getenv('PRESENCE_LOCAL_TTL', 10))
+        self._entries = {}
+        self._revision = 0
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        with self._lock:
+            entry = self._entries.get(email)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return dict(entry[0])
+
+    def get_many(self, emails):
+        now = time.monotonic()
+        with self._lock:
+            entries = [(email, self._entries.get(email)) for email in emails]
+        return {email: dict(entry[0]) for email, entry in entries if entry and now - entry[1] <= self.ttl}
+
+    def update(self, email, fields):
+        with self._lock:
+            state = dict(self._entries.get(email, ({}, 0))[0])
+            state.update(fields)
+            self._entries[email] = (state, time.monotonic())
+            self._revision += 1
+            return dict(state), self._revision
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {email: dict(state) for email, (state, at) in self._entries.items() if now - at <= self.ttl}
+
+    def revision(self):
+        return self._revision
+
+    def listen(self, callback):
+        # Single process: PresenceRegistry already fans events out locally
+        return None
+
+
+class RedisPresenceStore:
+    """Presence shared by every worker and host through Redis (see create_store())."""
+
+    shared = True
+    PREFIX = 'presence:'
+
+    def __init__(self, url=None):
+        import redis  # optional dependency, only needed for this backend
+
+        # Bounded connect, so an unreachable server cannot stall worker start-up on the ping
+        self._redis = redis.Redis.from_url(url or os.getenv('PRESENCE_REDIS_URL') or 'redis://localhost:6379/0',
+                                           socket_connect_timeout=5)
+
+    def ping(self):
+        self._redis.ping()
+
+    def get(self, email):
+        raw = self._redis.hgetall(self.PREFIX + email)
+        return {k.decode(): json.loads(v) for k, v in raw.items()} or None
+
+    def get_many(self, emails):
+        """Presence of several doctors in one round trip (pipelined HGETALLs)."""
+        emails = list(emails)
+        pipe = self._redis.pipeline(transaction=False)
+        for email in emails:
+            pipe.hgetall(self.PREFIX + email)
+        return {email: {k.decode(): json.loads(v) for k, v in raw.items()}
+                for email, raw in zip(emails, pipe.execute()) if raw}
+
+    def update(self, email, fields):
+        pipe = self._redis.pipeline()
+        pipe.hset(self.PREFIX + email, mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.hgetall(self.PREFIX + email)
+        pipe.incr(self.PREFIX + 'revision')
+        _, raw, revision = pipe.execute()
+        state = {k.decode(): json.loads(v) for k, v in raw.items()}
+        self._redis.publish(self.PREFIX + 'events', json.dumps({'email': email, 'state': state, 'revision': revision}))
+        return state, revision
+
+    def snapshot(self):
+        states = {}
+        for key in self._redis.scan_iter(match=self.PREFIX + '*@*'):
+            email = key.decode()[len(self.PREFIX):]
+            states[email] = self.get(email)
+        return states
+
+    def revision(self):
+        return int(self._redis.get(self.PREFIX + 'revision') or 0)
+
+    def listen(self, callback):
+        def _run():
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.PREFIX + 'events')
+            for message in pubsub.listen():
+                event = json.loads(message['data'])
+                callback(event['email'], event['state'], event['revision'])
+        thread = threading.Thread(target=_run, name='presence-listener', daemon=True)
+        thread.start()
+        return thread
+
+
+def create_store():
+    """
+    PRESENCE_BACKEND=memory|redis picks the store. Unset, Redis is used only
+    when PRESENCE_REDIS_URL is set and the server answers a ping at startup;
+    otherwise presence stays per worker (shared through Mongo, see
+    InMemoryPresenceStore), which with several workers is logged as
+    redis_unavailable.
+    """
+    backend = os.getenv('PRESENCE_BACKEND', '').lower()
+    if backend == 'memory':
+        return InMemoryPresenceStore()
+    if backend == 'redis':
+        # Chosen explicitly: no fallback, redis-py reconnects once the server is back
+        return RedisPresenceStore()
+    url = os.getenv('PRESENCE_REDIS_URL')
+    if not url:
+        if WORKERS > 1:
+            eventLog.event(log, 'redis_unavailable', level=eventLog.WARNING, workers=WORKERS,
+                           reason='PRESENCE_REDIS_URL not set, presence is per worker')
+        return InMemoryPresenceStore()
+    try:
+        store = RedisPresenceStore(url)
+        store.ping()
+        return store
+    except Exception as e:
+        # ImportError, or redis.exceptions.ConnectionError for a server that is not there
+        eventLog.event(log, 'redis_unavailable', level=eventLog.ERROR, workers=WORKERS,
+                       reason=f'{type(e).__name__}: {e}, presence is per worker')
+        return InMemoryPresenceStore()
+
+
+class Subscription(queue.Queue):
+    """Events for one SSE client; `dropped` once it fell too far behind."""
+
+    def __init__(self, maxsize=256):
+        super().__init__(maxsize=maxsize)
+        self.dropped = False
+
+
+class PresenceRegistry:
+    """
+    Doctor online/offline/in-meet state.
+
+    Writes go to the presence store, are published to subscribers (the SSE
+    stream) and are queued for a background thread that flushes them to Mongo
+    in one bulk_write every `flush_interval` seconds.
+
+    Every SSE client holds a worker thread for as long as it is connected, so
+    subscribers are capped at half the threads of a worker by default
+    (PRESENCE_MAX_SUBSCRIBERS) and streams end after PRESENCE_STREAM_SECONDS,
+    when the browser reconnects, possibly to a less busy worker.
+    """
+
+    def __init__(self, collection, store=None, flush_interval=None, max_subscribers=None):
+        self.collection = collection
+        self.store = store or create_store()
+        self.flush_interval = float(flush_interval or os.getenv('PRESENCE_FLUSH_INTERVAL', 1))
+        self.max_subscribers = int(max_subscribers or os.getenv('PRESENCE_MAX_SUBSCRIBERS') or max(1, THREADS // 2))
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._flusher = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+        self.flushed_writes = 0
+        self.flush_errors = 0
+
+    # ---- state ----
+
+    def set(self, email, **fields):
+        unknown = set(fields) - set(PRESENCE_FIELDS)
+        if unknown:
+            raise ValueError(f"Not presence fields: {', '.join(sorted(unknown))}")
+        self._ensure_started()
+        state, revision = self.store.update(email, fields)
+        with self._pending_lock:
+            self._pending.setdefault(email, {}).update(fields)
+        if not self.store.shared:
+            self._publish(email, state, revision)
+        return state
+
+    def get(self, email, field, default=None):
+        """Presence value from the store, else from Mongo (one projected read)."""
+        state = self.store.get(email)
+        if state is not None and field in state:
+            return state[field]
+        doc = self.collection.find_one({'email': email}, {field: 1, '_id': 0})
+        if doc is None:
+            return default
+        return doc.get(field, default)
+
+    def overlay(self, doc):
+        """Apply live presence on top of a doctor document read from Mongo."""
+        state = self.store.get(doc.get('email', ''))
+        if state:
+            doc = dict(doc)
+            doc.update(state)
+        return doc
+
+    def overlay_all(self, docs):
+        """overlay() for a list of documents, reading the store once for all of them."""
+        docs = list(docs)
+        states = self.store.get_many({doc.get('email', '') for doc in docs})
+        overlaid = []
+        for doc in docs:
+            state = states.get(doc.get('email', ''))
+            overlaid.append(dict(doc, **state) if state else doc)
+        return overlaid
+
+    def with_status(self, status):
+        """
+        Emails whose live status is `status`. With the in-memory store this only
+        covers this worker's recent writes; other workers' changes still reach
+        directory filters through Mongo, up to one flush interval later.
+        """
+        return [email for email, state in self.store.snapshot().items() if state.get('status') == status]
+
+    def revision(self):
+        return self.store.revision()
+
+    # ---- pub/sub ----
+
+    def subscribe(self):
+        self._ensure_started()
+        with self._subscribers_lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            events = Subscription()
+            self._subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            self._subscribers.discard(events)
+
+    def snapshot(self):
+        return self.store.snapshot()
+
+    def _publish(self, email, state, revision):
+        event = event_payload(email, state, revision)
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop it rather than block presence writes; its
+                # stream ends and the browser reconnects for a fresh snapshot
+                events.dropped = True
+                self.unsubscribe(events)
+
+    # ---- write-behind ----
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self.collection.bulk_write(
+                [UpdateOne({'email': email}, {'$set': fields}) for email, fields in pending.items()],
+                ordered=False,
+            )
+        except Exception as e:
+            self.flush_errors += 1
+            eventLog.event(log, 'presence_flush_failed', level=eventLog.WARNING, error=str(e))
+            with self._pending_lock:
+                # Newer writes that arrived meanwhile win over the retried ones
+                for email, fields in pending.items():
+                    merged = dict(fields)
+                    merged.update(self._pending.get(email, {}))
+                    self._pending[email] = merged
+            return 0
+        self.flushed_writes += len(pending)
+        return len(pending)
+
+    def stats(self):
+        return {
+            'backend': type(self.store).__name__,
+            'pending_writes': len(self._pending),
+            'flushed_writes': self.flushed_writes,
+            'flush_errors': self.flush_errors,
+            'subscribers': len(self._subscribers),
+            'revision': self.revision(),
+        }
+
+    def _ensure_started(self):
+        # Threads are started on first use, inside the gunicorn worker
+        if self._flusher is not None:
+            return
+        with self._start_lock:
+            if self._flusher is not None:
+                return
+            self._listener = self.store.listen(self._publish)
+            self._flusher = threading.Thread(target=self._flush_loop, name='presence-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def event_payload(email, state, revision):
+    return {
+        'email': email,
+        'status': state.get('status'),
+        'isInMeet': state.get('meet'),
+        'currentlyInMeet': state.get('currentlyInMeet'),
+        'revision': revision,
+    }
+
+
+def sse_stream(registry, events, heartbeat=15, max_seconds=None):
+    """
+    Server-Sent Events generator: a snapshot first, then one event per presence
+    change. Ends after `max_seconds` or once the subscriber was dropped; the
+    browser's EventSource then reconnects and gets a new snapshot.
+    """
+    max_seconds = float(max_seconds or os.getenv('PRESENCE_STREAM_SECONDS', 300))
+    deadline = time.monotonic() + max_seconds
+    try:
+        snapshot = [event_payload(email, state, registry.revision()) for email, state in registry.snapshot().items()]
+        yield f"retry: 3000\nevent: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+        while not events.dropped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = events.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: presence\nid: {event['revision']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        registry.unsubscribe(events)
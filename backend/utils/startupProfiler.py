@@ -0,0 +1,87 @@
+"""
+Cold-start profiler: wall time and newly imported modules per startup phase.
+
+Phases are recorded with `profiler.phase(name)` while app.py is imported and
+by lazily initialized integrations (utils/integrations.py) on first use, so
+the report shows what a cold start paid for and what was deferred. It is
+served at GET /startup/profile and printed at startup with STARTUP_PROFILE=true;
+a startup slower than STARTUP_BUDGET_MS is always reported.
+
+Measure a fresh import from the command line (non-zero exit when over budget):
+    cd backend
+    python -m utils.startupProfiler
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    def __init__(self, budget_ms=None):
+        self.budget_ms = float(budget_ms if budget_ms is not None else os.getenv('STARTUP_BUDGET_MS', 1500))
+        self.started = time.perf_counter()
+        self.ready_ms = None
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        modules = len(sys.modules)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {
+                'name': name,
+                'ms': round((time.perf_counter() - started) * 1000.0, 2),
+                'modules': len(sys.modules) - modules,
+                'deferred': self.ready_ms is not None,
+            }
+            with self._lock:
+                self.phases.append(entry)
+
+    def ready(self):
+        """Mark the app as ready to serve; later phases are reported as deferred."""
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000.0, 2)
+        if os.getenv('STARTUP_PROFILE', 'false').lower() == 'true' or self.over_budget():
+            print(self.format())
+
+    def over_budget(self):
+        return self.ready_ms is not None and self.ready_ms > self.budget_ms
+
+    def report(self):
+        with self._lock:
+            phases = list(self.phases)
+        return {
+            'ready_ms': self.ready_ms,
+            'budget_ms': self.budget_ms,
+            'over_budget': self.over_budget(),
+            'phases': phases,
+        }
+
+    def format(self):
+        report = self.report()
+        lines = [f"Startup: ready in {report['ready_ms']} ms (budget {report['budget_ms']:.0f} ms"
+                 f"{', OVER BUDGET' if report['over_budget'] else ''})"]
+        for entry in sorted(report['phases'], key=lambda e: e['ms'], reverse=True):
+            when = 'on first use' if entry['deferred'] else 'at startup'
+            lines.append(f"  {entry['ms']:>9.2f} ms  {entry['modules']:>4} modules  {entry['name']} ({when})")
+        return '\n'.join(lines)
+
+
+# Created when app.py is first imported, so `started` is the start of the cold start
+profiler = StartupProfiler()
+
+
+def main():
+    started = time.perf_counter()
+    os.environ['STARTUP_PROFILE'] = 'true'
+    import app  # noqa: F401  (the import is what is being measured)
+    print(f"Total import time: {(time.perf_counter() - started) * 1000.0:.2f} ms")
+    return 1 if app.profiler.over_budget() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Object storage for uploaded files (profile pictures, prescriptions).
+
+Objects are content addressed: the key is "<folder>/<sha256>", so the URL of
+a file is known before it is uploaded and the same bytes are only ever
+uploaded once. Two backends:
+
+    CloudinaryStorage  the existing Cloudinary account (public_id = key)
+    LocalStorage       files under backend/upload, served by /media/<path>
+
+STORAGE_BACKEND selects one (default: cloudinary when CLOUDINARY_CLOUD_NAME
+is set, local otherwise). put() returns only once the bytes are stored, so a
+URL saved on a document always resolves; a digest -> url index in Mongo lets
+every worker skip files that are already stored.
+"""
+import hashlib
+import mimetypes
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from utils import eventLog
+from utils.metrics import timed
+from utils.ttlCache import TTLCache
+
+DEFAULT_FOLDER = 'TelMedSphere'
+
+log = eventLog.get_logger('storage')
+
+
+class StorageError(Exception):
+    """An upload failed; never returned in place of a URL."""
+
+
+def _extension(filename, content_type=None):
+    ext = os.path.splitext(filename or '')[1].lower()
+    if not ext and content_type:
+        ext = mimetypes.guess_extension(content_type) or ''
+    return ext
+
+
+class CloudinaryStorage:
+    name = 'cloudinary'
+
+    def __init__(self):
+        self._sdk = None
+
+    def _cloudinary(self):
+        # Imported on first use so the SDK is not part of every cold start
+        if self._sdk is None:
+            import cloudinary
+            import cloudinary.uploader
+            import cloudinary.utils
+
+            cloudinary.config(
+                cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+                api_key=os.getenv('CLOUDINARY_API_KEY'),
+                api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+            )
+            self._sdk = cloudinary
+        return self._sdk
+
+    def url(self, key, ext):
+        return self._cloudinary().utils.cloudinary_url(key, secure=True, format=ext.lstrip('.') or None)[0]
+
+    def put(self, key, data, ext, content_type):
+        try:
+            sdk = self._cloudinary()
+            with timed('cloudinary', 'upload'):
+                response = sdk.uploader.upload(data, public_id=key, overwrite=False, unique_filename=False)
+        except Exception as e:
+            raise StorageError(str(e)) from e
+        return response['secure_url']
+
+
+class LocalStorage:
+    """Content-addressed files on local disk, served through the /media/<path> route."""
+
+    name = 'local'
+
+    def __init__(self, root, base_url=''):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, key, ext):
+        folder, digest = os.path.split(key)
+        # Fan out by digest prefix so no directory grows without bound
+        return os.path.join(self.root, folder, digest[:2], digest + ext)
+
+    def url(self, key, ext):
+        relative = os.path.relpath(self.path(key, ext), self.root).replace(os.sep, '/')
+        return f"{self.base_url}/media/{relative}"
+
+    def put(self, key, data, ext, content_type):
+        path = self.path(key, ext)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, 'wb') as fp:
+                    fp.write(data)
+                os.replace(tmp, path)
+            except OSError as e:
+                raise StorageError(str(e)) from e
+        return self.url(key, ext)
+
+
+class ObjectStore:
+    """
+    :param backend: CloudinaryStorage or LocalStorage
+    :param index: optional Mongo collection remembering digest -> url across workers
+    """
+
+    def __init__(self, backend, index=None, history=512):
+        self.backend = backend
+        self.index = index
+        self._known = TTLCache(maxsize=4096, ttl=3600)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history)
+        self._metrics = {'uploads': 0, 'dedupe_hits': 0, 'failures': 0, 'bytes_uploaded': 0,
+                         'upload_seconds': 0.0}
+
+    @staticmethod
+    def key(data, folder=DEFAULT_FOLDER):
+        return f"{folder}/{hashlib.sha256(data).hexdigest()}"
+
+    def _stored_url(self, key):
+        url = self._known.get(key)
+        if url is None and self.index is not None:
+            doc = self.index.find_one({'_id': key}, {'url': 1})
+            if doc:
+                url = doc['url']
+                self._known.set(key, url)
+        return url
+
+    def put(self, data, folder=DEFAULT_FOLDER, filename=None, content_type=None):
+        """
+        Store bytes and return their URL; bytes already stored are not uploaded again.
+
+        :raises StorageError: when the backend rejects the upload
+        """
+        key = self.key(data, folder)
+        url = self._stored_url(key)
+        if url is not None:
+            self._count('dedupe_hits')
+            return url
+
+        ext = _extension(filename, content_type)
+        started = time.perf_counter()
+        try:
+            url = self.backend.put(key, data, ext, content_type)
+        except StorageError:
+            self._count('failures')
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._metrics['uploads'] += 1
+            self._metrics['bytes_uploaded'] += len(data)
+            self._metrics['upload_seconds'] += elapsed
+            self._latencies.append(elapsed * 1000.0)
+
+        self._known.set(key, url)
+        if self.index is not None:
+            self.index.update_one({'_id': key}, {'$setOnInsert': {'url': url, 'size': len(data),
+                                                                 'created_at': datetime.now(timezone.utc)}},
+                                  upsert=True)
+        return url
+
+    def _count(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            latencies = sorted(self._latencies)
+        seconds = metrics.pop('upload_seconds')
+        metrics['backend'] = self.backend.name
+        metrics['throughput_bytes_per_sec'] = round(metrics['bytes_uploaded'] / seconds, 1) if seconds else 0.0
+        metrics['latency_ms'] = {
+            'mean': round(statistics.fmean(latencies), 3),
+            'p50': round(latencies[len(latencies) // 2], 3),
+            'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        } if latencies else {}
+        return metrics
+
+
+def create_store(index=None, root=None):
+    backend_name = os.getenv('STORAGE_BACKEND') or ('cloudinary' if os.getenv('CLOUDINARY_CLOUD_NAME') else 'local')
+    if backend_name == 'cloudinary':
+        backend = CloudinaryStorage()
+    else:
+        root = root or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'upload')
+        backend = LocalStorage(root, os.getenv('STORAGE_PUBLIC_URL', ''))
+    return ObjectStore(backend, index=index)
@@ -0,0 +1,83 @@
+import os
+
+import pymongo
+
+from utils.ttlCache import TTLCache
+
+PATIENT = 'patient'
+DOCTOR = 'doctor'
+
+# Per-route projections: only what each route reads, never the whole user document
+LOGIN_FIELDS = ('passwd', 'username', 'gender', 'phone', 'email', 'age', 'specialization', 'doctorId', 'verified',
+                'profile_picture')
+FEEDBACK_FIELDS = ('username', 'profile_picture')
+
+# Unique: register() relies on it instead of check-then-insert. Sparse, since
+# Google sign-ups may lack the field and must not collide on a missing email.
+# The index is per collection: MongoDB has no unique constraint spanning
+# patients and doctors, so an email registering as both at the same moment is
+# only stopped by register()'s role() check, which is best-effort.
+USER_INDEXES = [pymongo.IndexModel([('email', 1)], name='user_email', unique=True, sparse=True)]
+
+
+class UserDirectory:
+    """
+    Resolves an email to (role, document) in one round trip.
+
+    A user's role never changes, so email -> role is cached; with the role
+    known a lookup is a single projected find_one on the right collection.
+    Unknown emails are resolved with one aggregation that searches patients
+    and then doctors ($unionWith), instead of two sequential queries.
+    """
+
+    def __init__(self, patients, doctors, cache=None):
+        self.collections = {PATIENT: patients, DOCTOR: doctors}
+        self.roles = cache if cache is not None else TTLCache(
+            maxsize=int(os.getenv('USER_ROLE_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('USER_ROLE_CACHE_TTL', 3600)),
+        )
+
+    def collection(self, role):
+        return self.collections[role]
+
+    def resolve(self, email, fields=()):
+        """
+        :param fields: fields to return (empty = only identify the user)
+        :return: (role, document) or (None, None) when no user has this email
+        """
+        if not email:
+            return None, None
+        # Always an inclusion projection: {'_id': 0} alone would return the whole document
+        projection = {field: 1 for field in fields or ('email',)}
+        projection['_id'] = 0
+        role = self.roles.get(email)
+        if role is not None:
+            doc = self.collections[role].find_one({'email': email}, projection)
+            if doc is not None:
+                return role, doc
+            # Deleted since it was cached
+            self.roles.pop(email)
+
+        doc = next(self.collections[PATIENT].aggregate(self._union_pipeline(email, projection)), None)
+        if doc is None:
+            return None, None
+        role = doc.pop('_role')
+        self.roles.set(email, role)
+        return role, doc
+
+    def role(self, email):
+        return self.resolve(email)[0]
+
+    def _union_pipeline(self, email, projection):
+        def branch(role):
+            return [
+                {'$match': {'email': email}},
+                {'$limit': 1},
+                {'$project': dict(projection, _role={'$literal': role})},
+            ]
+
+        # Patients first, matching the lookup order the routes always used
+        return branch(PATIENT) + [
+            {'$unionWith': {'coll': self.collections[DOCTOR].name, 'pipeline': branch(DOCTOR)}},
+            {'$limit': 1},
+        ]
@@ -0,0 +1,295 @@
+"""
+Wallet balances with atomic updates and an append-only ledger.
+
+The balance stays on the user document (`wallet`) and only ever changes
+through `$inc`: credits unconditionally, debits only when the balance covers
+them, so concurrent payments can neither lose an update nor overdraw. Every
+balance change and every history entry the frontend records is appended to
+the `wallet_ledger` collection:
+
+    {email, kind: "movement", delta, balance, desc, created_at}
+    {email, kind: "history", history: {...}, created_at}
+    {email, kind: "checkpoint", balance, upto, created_at}
+
+Periodically fold old movements into checkpoints and check every balance
+against its ledger (--fix records the difference as an adjustment entry):
+    cd backend
+    python -m utils.walletLedger compact --older-than-days 30
+    python -m utils.walletLedger migrate-history
+
+build.sh runs migrate-history on every deploy; re-running it, even after a
+crash halfway, never copies an entry twice. Until a user's embedded
+`wallet_history` array is empty, GET history shows it ahead of the first ledger
+page, and migrated entries get _ids that sort before every regular ledger
+entry, in their original order, so history keeps its order whenever the
+migration runs.
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+
+COLLECTION = 'wallet_ledger'
+MOVEMENT = 'movement'
+HISTORY = 'history'
+CHECKPOINT = 'checkpoint'
+MAX_PAGE_SIZE = 200
+_ORIGIN = ObjectId('000000000000000000000000')
+
+LEDGER_INDEXES = [
+    pymongo.IndexModel([('email', 1), ('kind', 1), ('_id', 1)], name='ledger_email_kind'),
+]
+
+
+class WalletError(ValueError):
+    """Invalid amount, unknown user or insufficient balance."""
+
+
+class InsufficientFunds(WalletError):
+    pass
+
+
+def ensure_indexes(ledger):
+    ledger.create_indexes(LEDGER_INDEXES)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def parse_amount(value):
+    try:
+        amount = round(float(value))
+    except (TypeError, ValueError):
+        raise WalletError("Amount must be a number")
+    if amount < 0:
+        raise WalletError("Amount must not be negative")
+    return amount
+
+
+def _move(collection, ledger, email, delta, desc, guard=None):
+    query = {'email': email}
+    if guard is not None:
+        query.update(guard)
+    doc = collection.find_one_and_update(
+        query,
+        {'$inc': {'wallet': delta}},
+        projection={'wallet': 1, '_id': 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        return None
+    if delta:
+        ledger.insert_one({'email': email, 'kind': MOVEMENT, 'delta': delta, 'balance': doc['wallet'],
+                           'desc': desc, 'created_at': _now()})
+    return doc['wallet']
+
+
+def credit(collection, ledger, email, amount, desc='credit'):
+    """:return: the new balance"""
+    balance = _move(collection, ledger, email, amount, desc)
+    if balance is None:
+        raise WalletError("User not found")
+    return balance
+
+
+def debit(collection, ledger, email, amount, desc='debit'):
+    """
+    Take `amount` off the balance in one conditional update.
+
+    :raises InsufficientFunds: when the balance does not cover the amount
+    :return: the new balance
+    """
+    balance = _move(collection, ledger, email, -amount, desc, guard={'wallet': {'$gte': amount}})
+    if balance is None:
+        if collection.count_documents({'email': email}, limit=1):
+            raise InsufficientFunds("Insufficient wallet balance")
+        raise WalletError("User not found")
+    return balance
+
+
+def add_history(ledger, email, entry):
+    ledger.insert_one({'email': email, 'kind': HISTORY, 'history': entry, 'created_at': _now()})
+
+
+def history_page(ledger, email, limit=None, cursor=None):
+    """
+    History entries oldest first, optionally `limit` at a time after `cursor`.
+
+    :return: (entries, next_cursor)
+    """
+    query = {'email': email, 'kind': HISTORY}
+    if cursor:
+        try:
+            query['_id'] = {'$gt': ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise WalletError("Invalid cursor")
+    found = ledger.find(query, {'history': 1}).sort('_id', pymongo.ASCENDING)
+    if limit:
+        found = found.limit(limit + 1)
+    docs = list(found)
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = str(docs[-1]['_id'])
+    return [doc['history'] for doc in docs], next_cursor
+
+
+# ---- maintenance ----
+
+def _checkpoint(ledger, email):
+    return ledger.find_one({'email': email, 'kind': CHECKPOINT}, sort=[('_id', pymongo.DESCENDING)])
+
+
+def _movement_sum(ledger, email, after, before=None):
+    id_range = {'$gt': after}
+    if before is not None:
+        id_range['$lte'] = before
+    result = next(ledger.aggregate([
+        {'$match': {'email': email, 'kind': MOVEMENT, '_id': id_range}},
+        {'$group': {'_id': None, 'total': {'$sum': '$delta'}, 'last': {'$max': '$_id'}}},
+    ]), None)
+    return (result['total'], result['last']) if result else (0, None)
+
+
+def expected_balance(ledger, email):
+    checkpoint = _checkpoint(ledger, email)
+    start = checkpoint['balance'] if checkpoint else 0
+    upto = checkpoint['upto'] if checkpoint else _ORIGIN
+    return start + _movement_sum(ledger, email, upto)[0]
+
+
+def compact(ledger, email, balance, cutoff):
+    """
+    Fold movements older than `cutoff` into a new checkpoint and delete them.
+
+    Checkpoints record the last folded movement (`upto`), and sums only count
+    movements after it, so a crash between the insert and the delete cannot
+    count anything twice. A user without a checkpoint gets an opening one
+    carrying whatever balance predates the ledger.
+    """
+    checkpoint = _checkpoint(ledger, email)
+    if checkpoint is None:
+        opening = balance - _movement_sum(ledger, email, _ORIGIN)[0]
+        checkpoint = {'email': email, 'kind': CHECKPOINT, 'balance': opening, 'upto': _ORIGIN, 'created_at': _now()}
+        ledger.insert_one(checkpoint)
+    total, last = _movement_sum(ledger, email, checkpoint['upto'], ObjectId.from_datetime(cutoff))
+    if last is None:
+        return 0
+    new_id = ledger.insert_one({'email': email, 'kind': CHECKPOINT, 'balance': checkpoint['balance'] + total,
+                                'upto': last, 'created_at': _now()}).inserted_id
+    removed = ledger.delete_many({'email': email, '$or': [
+        {'kind': MOVEMENT, '_id': {'$lte': last}},
+        {'kind': CHECKPOINT, '_id': {'$lt': new_id}},
+    ]}).deleted_count
+    return removed
+
+
+def reconcile(collection, ledger, email, fix=False, settle=1.0):
+    """
+    Compare the stored balance with checkpoint + movements.
+
+    A payment between the two reads looks like drift, so the check is repeated
+    after `settle` seconds and only a stable difference is reported (and with
+    `fix`, recorded as an adjustment movement; the balance itself is never rewritten).
+    """
+    def drift():
+        doc = collection.find_one({'email': email}, {'wallet': 1, '_id': 0}) or {}
+        return doc.get('wallet', 0) - expected_balance(ledger, email)
+
+    first = drift()
+    if not first:
+        return 0
+    time.sleep(settle)
+    if drift() != first:
+        return 0
+    if fix:
+        ledger.insert_one({'email': email, 'kind': MOVEMENT, 'delta': first, 'desc': 'reconciliation adjustment',
+                           'created_at': _now()})
+    return first
+
+
+# Migrated entries are older than anything written to the ledger directly; their
+# ObjectId timestamps are shifted back this far so they sort first
+# Migrated entries: _id = prefix | 5 bytes of sha256(email) | 3 byte position in the user's history.
+# The prefix is below every real ObjectId timestamp, so they sort before regular entries.
+_LEGACY_PREFIX = struct.pack('>I', 1)
+MIGRATED_COUNT = 'wallet_history_migrated'
+
+
+def _legacy_id(email, position):
+    digest = hashlib.sha256(email.encode('utf-8')).digest()[:5]
+    return ObjectId(_LEGACY_PREFIX + digest + position.to_bytes(3, 'big'))
+
+
+def migrate_history(collection, ledger, batch_size=500, log=print):
+    """
+    Move embedded wallet_history arrays into the ledger in bulk batches.
+
+    Entry i of a user's array gets the _id of position wallet_history_migrated + i,
+    and the copy is an upsert on that _id, so a run interrupted between the
+    copy and the $pull writes the same documents again instead of duplicates.
+    The $pull and the position bump are one atomic update.
+    """
+    moved = 0
+    for doc in collection.find({'wallet_history.0': {'$exists': True}},
+                               {'email': 1, 'wallet_history': 1, MIGRATED_COUNT: 1}, batch_size=batch_size):
+        entries = doc['wallet_history']
+        offset = doc.get(MIGRATED_COUNT, 0)
+        ops = [UpdateOne({'_id': _legacy_id(doc['email'], offset + index), 'email': doc['email']},
+                         {'$setOnInsert': {'kind': HISTORY, 'history': entry, 'created_at': _now()}},
+                         upsert=True)
+               for index, entry in enumerate(entries)]
+        for start in range(0, len(ops), batch_size):
+            ledger.bulk_write(ops[start:start + batch_size], ordered=True)
+        # Only unset what was copied; entries appended meanwhile stay for the next run
+        collection.update_one({'_id': doc['_id'], MIGRATED_COUNT: doc.get(MIGRATED_COUNT)},
+                              {'$pull': {'wallet_history': {'$in': entries}}, '$inc': {MIGRATED_COUNT: len(entries)}})
+        moved += len(ops)
+    log(f"{collection.name}: moved {moved} history entries")
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Wallet ledger maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('compact', help='fold old movements into checkpoints and reconcile balances')
+    run.add_argument('--older-than-days', type=float, default=30)
+    run.add_argument('--fix', action='store_true', help='record stable differences as adjustment entries')
+    sub.add_parser('migrate-history', help='move embedded wallet_history arrays into the ledger')
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv('DBURL')).get_database('telmedsphere')
+    ledger = db[COLLECTION]
+    ensure_indexes(ledger)
+
+    if args.command == 'migrate-history':
+        for collection in (db.patients, db.doctors):
+            migrate_history(collection, ledger)
+        return 0
+
+    cutoff = _now() - timedelta(days=args.older_than_days)
+    removed, drifted = 0, 0
+    for collection in (db.patients, db.doctors):
+        for doc in collection.find({'wallet': {'$exists': True}}, {'email': 1, 'wallet': 1, '_id': 0}):
+            removed += compact(ledger, doc['email'], doc.get('wallet', 0), cutoff)
+            difference = reconcile(collection, ledger, doc['email'], fix=args.fix)
+            if difference:
+                drifted += 1
+                print(f"{doc['email']}: balance differs from ledger by {difference}")
+    print(f"Compacted {removed} ledger entries, {drifted} balances out of line")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,18 +4,62 @@ import numpy as np
 import pandas as pd
 import pickle
 import os
+import json
+import logging
+import random
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
+# One JSON line per event; per-request events are sampled (LOG_SAMPLE_RATE) and
+# never include the submitted symptoms or the feature vector
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+log = logging.getLogger("models")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+
+def log_event(name, level=logging.INFO, sample=None, **fields):
+    if sample is not None and random.random() >= sample:
+        return
+    log.log(level, json.dumps(dict(event=name, **fields), default=str))
+
 model = pickle.load(open('ExtraTrees', 'rb'))
 
 diseases = [ '(vertigo) Paroymsal Positional Vertigo', 'AIDS', 'Acne', 'Alcoholic hepatitis', 'Allergy', 'Arthritis', 'Bronchial Asthma', 'Cervical spondylosis', 'Chicken pox', 'Chronic cholestasis', 'Common Cold', 'Dengue', 'Diabetes', 'Dimorphic hemmorhoids(piles)', 'Drug Reaction', 'Fungal infection', 'GERD', 'Gastroenteritis', 'Heart attack', 'Hepatitis B', 'Hepatitis C', 'Hepatitis D', 'Hepatitis E', 'Hypertension', 'Hyperthyroidism', 'Hypoglycemia', 'Hypothyroidism', 'Impetigo', 'Jaundice', 'Malaria', 'Migraine', 'Osteoarthristis', 'Paralysis (brain hemorrhage)', 'Peptic ulcer diseae', 'Pneumonia', 'Psoriasis', 'Tuberculosis', 'Typhoid', 'Urinary tract infection', 'Varicose veins', 'hepatitis A' ]
 
 symptoms =  ['Disease', 'itching', 'skin_rash', 'nodal_skin_eruptions', 'continuous_sneezing', 'shivering', 'chills', 'joint_pain', 'stomach_pain', 'acidity', 'ulcers_on_tongue', 'muscle_wasting', 'vomiting', 'burning_micturition', 'fatigue', 'weight_gain', 'anxiety', 'cold_hands_and_feets', 'mood_swings', 'weight_loss', 'restlessness', 'lethargy', 'patches_in_throat', 'irregular_sugar_level', 'cough', 'high_fever', 'sunken_eyes', 'breathlessness', 'sweating', 'dehydration', 'indigestion', 'headache', 'yellowish_skin', 'dark_urine', 'nausea', 'loss_of_appetite', 'pain_behind_the_eyes', 'back_pain', 'constipation', 'abdominal_pain', 'diarrhoea', 'mild_fever', 'yellow_urine', 'yellowing_of_eyes', 'acute_liver_failure', 'fluid_overload', 'swelling_of_stomach', 'swelled_lymph_nodes', 'malaise', 'blurred_and_distorted_vision', 'phlegm', 'throat_irritation', 'redness_of_eyes', 'sinus_pressure', 'runny_nose', 'congestion', 'chest_pain', 'weakness_in_limbs', 'fast_heart_rate', 'pain_during_bowel_movements', 'pain_in_anal_region', 'bloody_stool', 'irritation_in_anus', 'neck_pain', 'dizziness', 'cramps', 'bruising', 'obesity', 'swollen_legs', 'swollen_blood_vessels', 'puffy_face_and_eyes', 'enlarged_thyroid', 'brittle_nails', 'swollen_extremeties', 'excessive_hunger', 'extra_marital_contacts', 'drying_and_tingling_lips', 'slurred_speech', 'knee_pain', 'hip_joint_pain', 'muscle_weakness', 'stiff_neck', 'swelling_joints', 'movement_stiffness', 'spinning_movements', 'loss_of_balance', 'unsteadiness', 'weakness_of_one_body_side', 'loss_of_smell', 'bladder_discomfort', 'continuous_feel_of_urine', 'passage_of_gases', 'internal_itching', 'toxic_look_(typhos)', 'depression', 'irritability', 'muscle_pain', 'altered_sensorium', 'red_spots_over_body', 'belly_pain', 'abnormal_menstruation', 'watering_from_eyes', 'increased_appetite', 'polyuria', 'family_history', 'mucoid_sputum', 'rusty_sputum', 'lack_of_concentration', 'visual_disturbances', 'receiving_blood_transfusion', 'receiving_unsterile_injections', 'coma', 'stomach_bleeding', 'distention_of_abdomen', 'history_of_alcohol_consumption', 'blood_in_sputum', 'prominent_veins_on_calf', 'palpitations', 'painful_walking', 'pus_filled_pimples', 'blackheads', 'scurring', 'skin_peeling', 'silver_like_dusting', 'small_dents_in_nails', 'inflammatory_nails', 'blister', 'red_sore_around_nose', 'yellow_crust_ooze', 'prognosis', 'skin rash','mood swings', 'weight loss', 'fast heart rate', 'excessive hunger', 'muscle weakness', 'abnormal menstruation', 'muscle wasting', 'patches in throat', 'high fever', 'extra marital contacts', 'yellowish skin', 'loss of appetite', 'abdominal pain', 'yellowing of eyes', 'chest pain', 'loss of balance', 'lack of concentration', 'blurred and distorted vision', 'drying and tingling lips', 'slurred speech', 'stiff neck', 'swelling joints', 'painful walking', 'dark urine', 'yellow urine', 'receiving blood transfusion', 'receiving unsterile injections', 'visual disturbances', 'burning micturition', 'bladder discomfort', 'foul smell of urine', 'continuous feel of urine', 'irregular sugar level', 'increased appetite', 'joint pain', 'skin peeling', 'small dents in nails', 'inflammatory nails', 'swelling of stomach', 'distention of abdomen', 'history of alcohol consumption', 'fluid overload', 'pain during bowel movements', 'pain in anal region', 'bloody stool', 'irritation in anus', 'acute liver failure', 'stomach bleeding', 'back pain', 'weakness in limbs', 'neck pain', 'mucoid sputum', 'mild fever', 'muscle pain', 'family history', 'continuous sneezing', 'watering from eyes', 'rusty sputum', 'weight gain', 'puffy face and eyes', 'enlarged thyroid', 'brittle nails', 'swollen extremeties', 'swollen legs', 'prominent veins on calf', 'stomach pain', 'spinning movements', 'sunken eyes', 'silver like dusting', 'swelled lymph nodes', 'blood in sputum', 'swollen blood vessels', 'toxic look (typhos)', 'belly pain', 'throat irritation', 'redness of eyes', 'sinus pressure', 'runny nose', 'loss of smell', 'passage of gases', 'cold hands and feets', 'weakness of one body side', 'altered sensorium', 'nodal skin eruptions', 'red sore around nose', 'yellow crust ooze', 'ulcers on tongue', 'spotting  urination', 'pain behind the eyes', 'red spots over body', 'internal itching']
 
-print(len(symptoms)) 
+# symptom -> feature column, first occurrence wins (same as symptoms.index)
+symptom_index = {}
+for column, name in enumerate(symptoms):
+    symptom_index.setdefault(name, column)
+BATCH_MAX = int(os.environ.get("PREDICT_BATCH_MAX", 256))
+
+def parse_symptoms(data):
+    """
+    Validate one symptom list and resolve it to feature columns; /predict and
+    /predict/batch both use this, so a list gets the same answer from either.
+    Repeated symptoms count once.
+
+    :return: (sorted feature columns, number of unrecognized entries)
+    :raises ValueError: with the message returned to the client
+    """
+    if not data or not isinstance(data, list):
+        raise ValueError('No symptoms provided')
+    if len(data) < 2:
+        raise ValueError('At least 2 symptoms are required for accurate prediction')
+    columns = set()
+    unknown = 0
+    for symptom in data:
+        index = symptom_index.get(symptom) if isinstance(symptom, str) else None
+        if index is None:
+            unknown += 1
+        else:
+            columns.add(index)
+    if len(columns) < 2:
+        raise ValueError('Not enough recognized symptoms. Please provide more symptoms.')
+    return sorted(columns), unknown
+
 desc=pd.read_csv("symptom_Description.csv")
 prec=pd.read_csv("symptom_precaution.csv") 
 
@@ -25,38 +69,21 @@ prec=pd.read_csv("symptom_precaution.csv")
 @app.route('/predict', methods=['POST'])
 def predict():
     data = request.get_json(force=True)
-    print("Received Data:", data)
-    
-    if not data:
-        return jsonify({'error': 'No symptoms provided'}), 400
-    
-    if len(data) < 2:
-        return jsonify({'error': 'At least 2 symptoms are required for accurate prediction'}), 400
+    try:
+        columns, unknown_symptoms = parse_symptoms(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    log_event('predict', sample=LOG_SAMPLE_RATE, provided=len(data), matched=len(columns), unknown=unknown_symptoms)
 
-    # Count matched symptoms
-    matched_symptoms = 0
-    
     # Create feature vector
     features = [0] * len(symptoms)
-    for symptom in data:
-        if symptom in symptoms:
-            index = symptoms.index(symptom)
-            features[index] = 1
-            matched_symptoms += 1
-        else:
-            print(f"Symptom not found: {symptom}")
-    
-    print("Feature Vector:", features)
-    print(f"Matched {matched_symptoms} symptoms out of {len(data)} provided")
-    
-    # Check if we have enough matched symptoms
-    if matched_symptoms < 2:
-        return jsonify({'error': 'Not enough recognized symptoms. Please provide more symptoms.'}), 400
+    for index in columns:
+        features[index] = 1
 
     # Model prediction
     try:
         proba = model.predict_proba([features])
-        print("Prediction Probabilities:", proba)
         
         # Check if we have meaningful prediction values
         max_probability = max(proba[0])
@@ -64,12 +91,14 @@ def predict():
             return jsonify({'error': 'The symptom combination does not match known disease patterns. Please provide more specific symptoms.'}), 400
             
     except Exception as e:
-        print(f"Model Prediction Error: {str(e)}")
+        log_event('model_error', level=logging.ERROR, error=str(e))
         return jsonify({'error': str(e), 'message': 'Prediction failed.'}), 500
 
-    # Process results
-    top5_idx = np.argsort(proba[0])[-5:][::-1]
-    top5_proba = np.sort(proba[0])[-5:][::-1]
+    return jsonify(top_diseases(proba[0]))
+
+def top_diseases(proba_row):
+    top5_idx = np.argsort(proba_row)[-5:][::-1]
+    top5_proba = np.sort(proba_row)[-5:][::-1]
     top5_diseases = [diseases[i] for i in top5_idx]
 
     response = []
@@ -88,7 +117,45 @@ def predict():
             'description': disp,
             'precautions': precautions
         })
-    return jsonify(response)
+    return response
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    data = request.get_json(force=True)
+    symptom_lists = data.get('symptoms') if isinstance(data, dict) else data
+    if not isinstance(symptom_lists, list) or not symptom_lists:
+        return jsonify({'error': 'A non-empty list of symptom lists is required'}), 400
+    if len(symptom_lists) > BATCH_MAX:
+        return jsonify({'error': f'At most {BATCH_MAX} symptom lists can be scored per request'}), 413
+
+    results = [None] * len(symptom_lists)
+    row_ids, col_ids, positions = [], [], []
+    for position, items in enumerate(symptom_lists):
+        try:
+            columns, _ = parse_symptoms(items)
+        except ValueError as e:
+            results[position] = {'error': str(e)}
+            continue
+        row = len(positions)
+        positions.append(position)
+        row_ids.extend([row] * len(columns))
+        col_ids.extend(columns)
+
+    if positions:
+        features = np.zeros((len(positions), len(symptoms)), dtype=np.float32)
+        features[row_ids, col_ids] = 1
+        try:
+            proba = model.predict_proba(features)
+        except Exception as e:
+            log_event('model_error', level=logging.ERROR, error=str(e))
+            return jsonify({'error': str(e), 'message': 'Prediction failed.'}), 500
+        for position, proba_row in zip(positions, proba):
+            if max(proba_row) < 0.1:
+                results[position] = {'error': 'The symptom combination does not match known disease patterns. Please provide more specific symptoms.'}
+            else:
+                results[position] = {'predictions': top_diseases(proba_row)}
+
+    return jsonify({'results': results})
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # Default to 5000 if PORT is not set